@@ -22,6 +22,15 @@ from microlab_instruments import \
     Chen, \
     Traxex, \
     Xin, \
-    Kerrigan
+    Kerrigan, \
+    TCPIP_INSTRUMENTS
 from base_classes import AardvarkInstrument as Aardvark
+from base_classes import GPIBGroup
+from base_classes import BusScheduler
+from base_classes import SCPIError
+from base_classes import read_temps
+from sampler import TempSampler
+from pipeline import AcquisitionPipeline, SharedRingBuffer
+from timing import MeasurementScheduler
+from reducers import RunningStats, MinMax, Histogram, Decimator, reduce_stream
 
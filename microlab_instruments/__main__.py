@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+.. module:: __main__
+   :synopsis: Command-line access to the GPIB and TCP/IP instruments.
+
+Instruments are addressed by nickname.  Each one is connected at most once
+per run, and is not reset unless ``--reset`` is given::
+
+    python -m microlab_instruments list
+    python -m microlab_instruments ask yveltal '*IDN?' ':format:data?'
+    python -m microlab_instruments write yveltal ':source1:voltage 1.5' ':output1 on'
+    python -m microlab_instruments configure giratina sweep.txt
+    python -m microlab_instruments stream yveltal ':fetch:arr:curr? (@1)' -o curr.txt -n 100
+    python -m microlab_instruments stream deoxys ':waveform:data?' -o wave.bin --binary
+    python -m microlab_instruments bench yveltal --binary-query ':fetch:arr:curr? (@1)'
+    python -m microlab_instruments latency yveltal giratina arceus
+
+The hardware backends (``gpib``\ , ``aardvark_py``\ , ``serial``\ ) are only
+imported when an instrument that needs them is connected.
+"""
+
+from __future__ import absolute_import
+
+import argparse
+import sys
+import time
+from array import array
+
+from microlab_instruments import base_classes as bc
+from microlab_instruments import microlab_instruments as instruments
+from microlab_instruments.timing import monotonic
+
+
+def instrument_classes():
+    """Returns a mapping of nicknames to the classes of the GPIB and TCP/IP
+    instruments.
+    """
+    out = {}
+    for name, value in vars(instruments).items():
+        if not (name.isupper() and isinstance(value, dict) and 'nickname' in value):
+            continue
+        cls = getattr(instruments, value['nickname'].capitalize(), None)
+        if isinstance(cls, type) and issubclass(cls, bc.SCPIInstrument):
+            out[value['nickname']] = cls
+    return out
+
+
+class Session(object):
+    """Connects instruments on first use and keeps the connections open for
+    the rest of the run.
+    """
+    def __init__(self, reset=False):
+        self.reset = reset
+        self.__classes = instrument_classes()
+        self.__connected = {}
+
+    def __getitem__(self, nickname):
+        nickname = nickname.lower()
+        if nickname not in self.__connected:
+            if nickname not in self.__classes:
+                raise SystemExit('Unknown instrument: {0}.  Try "list".'.format(nickname))
+            self.__connected[nickname] = self.__classes[nickname](reset=self.reset)
+        return self.__connected[nickname]
+
+
+def cmd_list(session, args):
+    classes = instrument_classes()
+    for nickname in sorted(classes):
+        cls = classes[nickname]
+        data = getattr(instruments, nickname.upper())
+        if issubclass(cls, bc.TCPIPInstrument):
+            address = '{0}:{1}'.format(*data['socket'])
+        else:
+            address = 'GPIB'
+        print '{0:<10} {1:<20} {2}'.format(nickname, address, data['name'])
+    return 0
+
+
+def cmd_ask(session, args):
+    instrument = session[args.instrument]
+    for query in args.queries:
+        print instrument.ask_ascii(query).rstrip('\n')
+    return 0
+
+
+def cmd_write(session, args):
+    instrument = session[args.instrument]
+    for command in args.commands:
+        instrument.write(command)
+    print instrument.ask_ascii('*OPC?').rstrip('\n')
+    return 0
+
+
+def cmd_configure(session, args):
+    session[args.instrument].configure(args.config_file)
+    return 0
+
+
+def cmd_stream(session, args):
+    instrument = session[args.instrument]
+    fd = open(args.output, 'wb' if args.binary else 'w')
+    count = 0
+    points = 0
+    start = monotonic()
+    deadline = start
+    try:
+        while not args.count or count < args.count:
+            values = instrument.ask_ieee754(args.query)
+            if args.binary:
+                array('d', values).tofile(fd)
+            else:
+                fd.write('\n'.join(repr(v) for v in values))
+                fd.write('\n')
+            count += 1
+            points += len(values)
+            deadline += args.interval
+            delay = deadline - monotonic()
+            if delay > 0:
+                time.sleep(delay)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fd.close()
+    elapsed = monotonic() - start
+    sys.stderr.write('{0} blocks, {1} points in {2:.2f} s ({3:.0f} points/s)\n'.format(
+        count, points, elapsed, points / elapsed if elapsed else 0))
+    return 0
+
+
+def _timed(function, count):
+    """Call ``function`` ``count`` times and return the durations.
+    """
+    out = []
+    for n in xrange(count):
+        t = monotonic()
+        function()
+        out.append(monotonic() - t)
+    return out
+
+
+def _summary(durations):
+    mean = sum(durations) / len(durations)
+    out = 'min {0:.3f}  mean {1:.3f}  max {2:.3f} ms'.format(
+        1e3 * min(durations), 1e3 * mean, 1e3 * max(durations))
+    return out
+
+
+def cmd_bench(session, args):
+    t = monotonic()
+    instrument = session[args.instrument]
+    print 'connect       {0:.3f} ms'.format(1e3 * (monotonic() - t))
+    durations = _timed(lambda: instrument.ask_ascii(args.query), args.count)
+    print 'ask_ascii     {0}  ({1:.0f} queries/s)'.format(
+        _summary(durations), len(durations) / sum(durations))
+    if args.binary_query:
+        sizes = []
+        durations = _timed(lambda: sizes.append(len(instrument.ask_binary(args.binary_query))),
+                           args.count)
+        print 'ask_binary    {0}  ({1:.2f} MB/s)'.format(
+            _summary(durations), sum(sizes) / sum(durations) / 1e6)
+    return 0
+
+
+def cmd_latency(session, args):
+    for nickname in args.instruments:
+        try:
+            instrument = session[nickname]
+            durations = _timed(lambda: instrument.ask_ascii('*OPC?'), args.count)
+        except Exception, e:
+            print '{0:<10} {1}'.format(nickname, e)
+            continue
+        print '{0:<10} {1}'.format(nickname, _summary(durations))
+    return 0
+
+
+def parser():
+    p = argparse.ArgumentParser(prog='python -m microlab_instruments',
+                                description='Query and configure the Microlab instruments.')
+    p.add_argument('--reset', action='store_true',
+                   help='reset instruments after connecting')
+    sub = p.add_subparsers()
+
+    s = sub.add_parser('list', help='list the GPIB and TCP/IP instruments')
+    s.set_defaults(function=cmd_list)
+
+    s = sub.add_parser('ask', help='send queries and print the ASCII responses')
+    s.add_argument('instrument')
+    s.add_argument('queries', nargs='+')
+    s.set_defaults(function=cmd_ask)
+
+    s = sub.add_parser('write', help='send program commands, then wait with *OPC?')
+    s.add_argument('instrument')
+    s.add_argument('commands', nargs='+')
+    s.set_defaults(function=cmd_write)
+
+    s = sub.add_parser('configure', help='send the commands in a configuration file')
+    s.add_argument('instrument')
+    s.add_argument('config_file')
+    s.set_defaults(function=cmd_configure)
+
+    s = sub.add_parser('stream', help='repeat an IEEE-754 query and save the data')
+    s.add_argument('instrument')
+    s.add_argument('query')
+    s.add_argument('-o', '--output', required=True)
+    s.add_argument('-n', '--count', type=int, default=0,
+                   help='number of queries; 0 (default) runs until interrupted')
+    s.add_argument('-i', '--interval', type=float, default=0.0,
+                   help='seconds between queries')
+    s.add_argument('--binary', action='store_true',
+                   help='write native doubles instead of one number per line')
+    s.set_defaults(function=cmd_stream)
+
+    s = sub.add_parser('bench', help='measure query round trips and binary throughput')
+    s.add_argument('instrument')
+    s.add_argument('-n', '--count', type=int, default=100)
+    s.add_argument('--query', default='*IDN?')
+    s.add_argument('--binary-query')
+    s.set_defaults(function=cmd_bench)
+
+    s = sub.add_parser('latency', help='measure the *OPC? round trip of instruments')
+    s.add_argument('instruments', nargs='+')
+    s.add_argument('-n', '--count', type=int, default=20)
+    s.set_defaults(function=cmd_latency)
+    return p
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    session = Session(reset=args.reset)
+    return args.function(session, args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
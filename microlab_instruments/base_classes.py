@@ -6,21 +6,87 @@
    :synopsis: Defines the base classes from which all instruments are derived.
 """
 
-import aardvark_py as aapy
-import gpib
-import serial
+import errno
+import heapq
+import importlib
+import itertools
+import mmap
+import os
+import re
 import socket
+import sys
+import threading
 import time
+from collections import OrderedDict
+from contextlib import contextmanager
 from random import randint
 from array import array
 from struct import unpack
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class _LazyModule(object):
+    """Stands in for a hardware backend module and imports it on first use,
+    so that importing this package costs nothing for backends that are not
+    used, and does not require them to be installed.
+    """
+    def __init__(self, name):
+        self.__name = name
+        self.__module = None
+
+    def __getattr__(self, attr):
+        if self.__module is None:
+            self.__module = importlib.import_module(self.__name)
+        return getattr(self.__module, attr)
+
+aapy = _LazyModule('aardvark_py')
+gpib = _LazyModule('gpib')
+serial = _LazyModule('serial')
+
+class SCPIError(Exception):
+    """Raised when the SCPI error queue of an instrument is not empty.  See
+    :meth:`SCPIInstrument.enable_error_checking`\ .
+    """
+    def __init__(self, errors):
+        #: A *list* of ``(code, message, suspects)`` tuples.
+        self.errors = errors
+        lines = ['{0},"{1}" after {2}'.format(code, message, '; '.join(suspects))
+                 for code, message, suspects in errors]
+        super(SCPIError, self).__init__('\n'.join(lines))
+
+
 class SCPIInstrument(object):
     def _is_little_endian(self):
         """Returns ``True`` if the most significant bit as at the right,
         ``False`` if the most significant bit is at the left.
         """
-        return self.ask_ascii(self.DATA['get_byte_order']) == self.DATA['byte_order_little']
+        return self.ask_ascii(self.DATA['get_byte_order']).strip() == self.DATA['byte_order_little']
+
+    def _initialize(self):
+        """Send the commands in ``DATA['init_commands']``\ .
+        """
+        for c in self.DATA.get('init_commands', ()):
+            self.write(c)
+        self.flush()
+
+    def _read_exactly(self, size):
+        """Read exactly ``size`` bytes from the instrument, so that nothing
+        beyond them is consumed.
+        """
+        stream = []
+        received = 0
+        while received < size:
+            s = self.read(size - received)
+            if not s:
+                raise Exception, 'Instrument returned no data'
+            stream.append(s)
+            received += len(s)
+        out = ''.join(stream)
+        return out
 
     def _get_expected_bytes(self):
         """Used by methods that expect fixed-length binary or IEEE-754 data.
@@ -39,12 +105,12 @@ class SCPIInstrument(object):
         #41097
         """
         # Read number of decimal digits to represent expected data size
-        s = self.read(2)
+        s = self._read_exactly(2)
         size_length = int(s[1])
 
         # Read expected data size in bytes.  The ``expected_size`` is increased
         # by 1 to include the terminating newline character.
-        s = self.read(size_length)
+        s = self._read_exactly(size_length)
         expected_size = int(s) + 1
         return expected_size
 
@@ -136,11 +202,7 @@ class SCPIInstrument(object):
         expected_size = self._get_expected_bytes()
 
         # Read actual data
-        stream = []
-        while sum(map(len, stream)) < expected_size:
-            s = self.read(expected_size)
-            stream.append(s)
-        out = ''.join(stream)
+        out = self._read_exactly(expected_size)
         return out
 
     def read_ieee754(self):
@@ -160,9 +222,12 @@ class SCPIInstrument(object):
         # Convert floating-point to Python ``float``
         # single- or double-precision
         if self.DATA['nickname'] in \
-                ('genesect',
+                ('darkrai',
+                 'genesect',
                  'giratina',
-                 'yveltal'):
+                 'rayquaza',
+                 'yveltal',
+                 'zygarde'):
 
             # Calculate number of floating point data points
             # Query precision and discard newline character
@@ -184,6 +249,7 @@ class SCPIInstrument(object):
             # Convert the binary data to Python ``float``s
             fmt = '{0}{1}{2}'.format(b, n, fmt_char)
             out = list(unpack(fmt, stream))
+            self._reduce(out)
             return out
         # half-precision
         elif self.DATA['nickname'] in \
@@ -191,10 +257,475 @@ class SCPIInstrument(object):
             # Chop the stream into 16-bit elements
             stream = [w for w in self._chop16(stream)]
 
-            # Convert the stream into ``float``\ s
-            out = map(self._half_to_float, stream)
+            # Convert the stream into ``float``\ s, with one byte order
+            # query for the whole block
+            b = '<' if self._is_little_endian() else '>'
+            out = [self._half_to_float(h, b) for h in stream]
+            self._reduce(out)
             return out
 
+    _reducers = ()
+    _interleave = 1
+
+    def attach_reducers(self, reducers, offset=0, stride=1):
+        """Update ``reducers`` with every block of numbers read by
+        :meth:`.read_ieee754`\ , and so by :meth:`.ask_ieee754` and the
+        functions built on it.  See :mod:`reducers`\ .
+
+        Reads that return several interleaved quantities, such as the
+        multi-element readings of
+        :meth:`~SourceMeasureInstrument.read_log` or the channels of
+        :meth:`~SourceMeasureInstrument.fetch_channels`\ , only update
+        reducers attached with a matching ``stride``\ , so unrelated
+        quantities are never mixed.
+
+        :param list reducers:
+            Objects with an ``update(chunk)`` method.
+        :param int offset:
+            Defaults to 0.  Index of the quantity to reduce within each group
+            of ``stride`` values.
+        :param int stride:
+            Defaults to 1.  Number of interleaved quantities per reading.
+
+        .. code-block:: python
+
+            # Reduce the currents of readings logged as ('VOLT', 'CURR')
+            yveltal.attach_reducers([mi.RunningStats()], offset=1, stride=2)
+        """
+        self._reducers = tuple(self._reducers) + tuple(
+            (r, offset, stride) for r in reducers)
+
+    def detach_reducers(self):
+        """Stop updating the attached reducers.
+        """
+        self._reducers = ()
+
+    @contextmanager
+    def _interleaved(self, stride):
+        """Mark the blocks read within the ``with`` block as holding
+        ``stride`` interleaved quantities.
+        """
+        self._interleave = stride
+        try:
+            yield
+        finally:
+            self._interleave = 1
+
+    def _reduce(self, values):
+        for r, offset, stride in self._reducers:
+            if stride == self._interleave:
+                r.update(values[offset::stride] if stride > 1 else values)
+
+    def _query(self, scpi_string, reader):
+        """Send the query ``scpi_string`` and return the result of calling
+        ``reader``\ .  All ``ask_*`` functions go through here, so transports
+        may override it to retry failed queries.
+        """
+        if self._piggyback_error_query(reader):
+            self.write(''.join([scpi_string, ';', self.ERROR_QUERY]))
+            response = reader()
+            # The message may itself contain ';', so find the error entry by
+            # its shape instead of splitting at the last ';'
+            match = self.ERROR_RESPONSE.search(response)
+            if match is None:
+                raise Exception, 'No error queue entry in the response to {0}'.format(scpi_string)
+            if match.start() == 0:
+                # The query failed, so the only response is the error
+                errors = self._handle_errors([match.group(1)])
+                raise SCPIError(errors)
+            self._handle_errors([match.group(1)])
+            return ''.join([response[:match.start()], '\n'])
+        self.write(scpi_string)
+        return reader()
+
+    #: Query that pops the oldest entry of the SCPI error queue.
+    ERROR_QUERY = ':SYST:ERR?'
+
+    #: Matches the response to :attr:`ERROR_QUERY` at the end of a compound
+    #: response, as in ``1.5;-222,"Data out of range;:SOUR:VOLT 99"``\ .
+    ERROR_RESPONSE = re.compile(r'(?:^|;)\s*([+-]?\d+,"(?:[^"]|"")*")\s*$')
+
+    _error_checking = None
+    _draining = False
+
+    def enable_error_checking(self, every=None, piggyback=False, raise_errors=True):
+        """Check the SCPI error queue in batches instead of after every
+        command.  Commands written since the last check are remembered so that
+        errors can be attributed to them.  The error queue is drained:
+
+        * whenever :meth:`.check_errors` is called,
+        * after every ``every`` program commands, if ``every`` is given, and
+        * with the next :meth:`.ask_ascii`\ , if ``piggyback`` is ``True``\ .
+          The error query is appended to that query as a compound command, so
+          it costs no extra round trip.  If that query itself fails, there is
+          no response to return, so :class:`SCPIError` is raised even if
+          ``raise_errors`` is ``False``\ .
+
+        :param int every:
+            Defaults to ``None``.  Number of program commands between checks.
+        :param bool piggyback:
+            Defaults to ``False``.  Append the error query to the next ASCII
+            query.
+        :param bool raise_errors:
+            Defaults to ``True``.  Raise :class:`SCPIError` when errors are
+            found.  Otherwise they are only appended to :attr:`error_log`\ .
+
+        .. code-block:: python
+
+            giratina.enable_error_checking(every=20, piggyback=True)
+            giratina.write(':source:voltage:start 0')
+            giratina.write(':source:voltage:stopp 5')   # typo
+            giratina.check_errors()  # raises SCPIError naming the typo
+        """
+        self._error_checking = {
+            'every'       : every,
+            'piggyback'   : piggyback,
+            'raise_errors': raise_errors,
+            }
+        self._pending_commands = []
+        self.error_log = []
+
+    def disable_error_checking(self):
+        """Stop tracking commands and checking the SCPI error queue.
+        """
+        self._error_checking = None
+
+    def _command_sent(self, scpi_string):
+        """Called by transports after every :meth:`.write`\ .
+        """
+        if self._query_cache is not None:
+            self._invalidate_cache(scpi_string)
+        if self._error_checking is None or self._draining:
+            return
+        if scpi_string.endswith(self.ERROR_QUERY):
+            scpi_string = scpi_string[:-len(self.ERROR_QUERY)].rstrip(';')
+            if not scpi_string:
+                return
+        self._pending_commands.append(scpi_string)
+        every = self._error_checking['every']
+        # Never drain after a query, whose response has not been read yet
+        if every and '?' not in scpi_string and len(self._pending_commands) >= every:
+            self.check_errors()
+
+    def _piggyback_error_query(self, reader):
+        return (self._error_checking is not None and
+                self._error_checking['piggyback'] and
+                not self._draining and
+                reader == self.read_ascii)
+
+    def check_errors(self):
+        """Drain the SCPI error queue and attribute the errors to the commands
+        written since the last check.
+
+        :returns out:
+            A *list* of ``(code, message, suspects)`` tuples, where
+            ``suspects`` is the list of commands that probably caused the
+            error.
+
+        :raises SCPIError:
+            If errors are found and ``raise_errors`` was ``True``\ .
+        """
+        return self._handle_errors([])
+
+    def _drain_error_queue(self):
+        responses = []
+        self._draining = True
+        try:
+            while True:
+                response = self.ask_ascii(self.ERROR_QUERY).strip()
+                responses.append(response)
+                if self._error_code(response) == 0:
+                    break
+        finally:
+            self._draining = False
+        return responses
+
+    def _error_code(self, response):
+        return int(response.split(',', 1)[0])
+
+    def _handle_errors(self, responses):
+        """Finish draining the error queue, starting from ``responses``
+        already read, and attribute the errors.
+        """
+        if self._error_checking is None:
+            return []
+        if not responses or self._error_code(responses[-1]) != 0:
+            responses = responses + self._drain_error_queue()
+        pending = self._pending_commands
+        self._pending_commands = []
+        out = []
+        for response in responses:
+            code = self._error_code(response)
+            if code == 0:
+                continue
+            message = response.split(',', 1)[1].strip().strip('"') if ',' in response else ''
+            # Instruments often quote the offending header in the message
+            suspects = [c for c in pending
+                        if len(c.split()[0].strip(':')) > 3 and
+                        c.split()[0].strip(':').upper() in message.upper()]
+            out.append((code, message, suspects or list(pending)))
+        self.error_log.extend(out)
+        if out and self._error_checking['raise_errors']:
+            raise SCPIError(out)
+        return out
+
+    _coalescing = None
+
+    def enable_coalescing(self, max_bytes=4096, max_delay=0.05, separator='\n'):
+        """Buffer program commands instead of sending each one on its own, and
+        send them together as one payload.  The buffer is sent:
+
+        * with the next query, in the same payload,
+        * before any read,
+        * when :meth:`.flush` or :meth:`.disable_coalescing` is called, and
+        * with the next command once the buffer holds ``max_bytes`` bytes or
+          its oldest command is ``max_delay`` seconds old.
+
+        There is no timer, so call :meth:`.flush` after the last command of a
+        setup that is not followed by a query.
+
+        :param int max_bytes:
+            Defaults to 4096.  Size of the buffer that causes it to be sent.
+        :param float max_delay:
+            Defaults to 0.05 seconds.  Age of the oldest buffered command that
+            causes the buffer to be sent.
+        :param str separator:
+            Defaults to ``'\\n'``\ , which sends every command as its own
+            program message.  ``';'`` sends one compound command instead, in
+            which case headers that do not start with ``:`` are relative to
+            the previous command.
+
+        .. code-block:: python
+
+            yveltal.enable_coalescing()
+            yveltal.write(':source1:function:mode voltage')
+            yveltal.write(':source1:voltage 1.5')
+            yveltal.write(':sense1:current:protection 0.01')
+            yveltal.write(':output1 on')
+            # The four commands and the query go out in one send
+            print yveltal.ask_ascii(':output1?')
+        """
+        self._coalescing = {
+            'max_bytes' : max_bytes,
+            'max_delay' : max_delay,
+            'separator' : separator,
+            'pending'   : [],
+            'size'      : 0,
+            'since'     : None,
+            }
+
+    def disable_coalescing(self):
+        """Send any buffered commands and stop buffering.
+        """
+        self.flush()
+        self._coalescing = None
+
+    def flush(self):
+        """Send the buffered commands now, if any.
+        """
+        if self._coalescing is None or not self._coalescing['pending']:
+            return
+        self._write_payload(self._take_pending([]))
+
+    def _take_pending(self, commands):
+        """Empty the buffer and join its commands, followed by ``commands``\ ,
+        into one payload.
+        """
+        c = self._coalescing
+        out = c['separator'].join(c['pending'] + commands)
+        c['pending'] = []
+        c['size'] = 0
+        c['since'] = None
+        return out
+
+    def _coalesce(self, scpi_string):
+        """Called by transports at the start of :meth:`.write`\ .  Returns the
+        payload to send now, or ``None`` if ``scpi_string`` was buffered.
+        """
+        c = self._coalescing
+        if c is None:
+            return scpi_string
+        if '?' in scpi_string:
+            return self._take_pending([scpi_string])
+        if c['since'] is None:
+            c['since'] = time.time()
+        c['pending'].append(scpi_string)
+        c['size'] += len(scpi_string) + len(c['separator'])
+        if c['size'] >= c['max_bytes'] or time.time() - c['since'] >= c['max_delay']:
+            return self._take_pending([])
+        return None
+
+    _query_cache = None
+
+    #: Short-form headers of commands that change the whole configuration of
+    #: the instrument, so they empty the whole query cache.
+    CACHE_RESETTING_COMMANDS = ('*RST', '*RCL', 'SYST:PRES')
+
+    #: Short forms of root nodes that may be left out of program headers, as
+    #: in ``:VOLT 1.5`` for ``:SOUR:VOLT 1.5``\ .  Instruments with other
+    #: optional roots list them in ``DATA['default_nodes']``\ .
+    DEFAULT_NODES = ('SOUR', 'SENS')
+
+    def enable_query_cache(self, ttls=None, size=128):
+        """Remember the responses of configuration queries so that asking
+        again costs no round trip.  Only :meth:`.ask_ascii` queries listed in
+        ``ttls`` are cached.  A cached response is dropped when its TTL runs
+        out, when a command of the same SCPI subsystem is written (for
+        example, ``:format:data real,64`` drops ``:FORM:BORD?``\ ), or when
+        the instrument is reset.  Optional roots in :attr:`DEFAULT_NODES` are
+        skipped, so ``:volt 1.5`` also drops ``:SOUR:VOLT?``\ .
+
+        Short and long forms of a mnemonic are treated the same, so
+        ``':format:border?'`` and ``':FORM:BORD?'`` share one entry.
+
+        :param dict ttls:
+            Defaults to ``None``, which caches ``*IDN?`` and the byte order
+            and data format queries in the ``DATA`` dict.  Maps queries to
+            their time-to-live in seconds, or to ``None`` to keep the
+            response until it is invalidated.
+        :param int size:
+            Defaults to 128.  Number of responses kept.  The least recently
+            used response is evicted first.
+
+        .. code-block:: python
+
+            yveltal.enable_query_cache({':format:border?': None,
+                                        ':format:data?': None,
+                                        ':sense:current:range?': 5.0})
+            yveltal.ask_ieee754(':fetch:arr:curr? (@1)')  # format queries are cached
+            print yveltal.cache_stats()
+        """
+        if ttls is None:
+            ttls = dict((self.DATA[k], None)
+                        for k in ('get_byte_order', 'get_data_format')
+                        if self.DATA.get(k))
+            ttls['*IDN?'] = None
+        self._query_cache = OrderedDict()
+        self._cache_ttls = dict((self._short_form(q), ttl) for q, ttl in ttls.items())
+        self._cache_size = size
+        self._cache_stats = dict.fromkeys(('hits', 'misses', 'expired',
+                                           'evictions', 'invalidations'), 0)
+
+    def disable_query_cache(self):
+        """Stop caching query responses and forget the cached ones.
+        """
+        self._query_cache = None
+
+    def clear_query_cache(self):
+        """Forget the cached responses, for example after changing settings
+        on the front panel.  Called by
+        :meth:`~TCPIPInstrument.reconnect`\ , since the instrument may have
+        rebooted.
+        """
+        if self._query_cache is not None:
+            self._query_cache.clear()
+
+    def cache_stats(self):
+        """Returns query cache counters.
+
+        :returns out:
+            A mapping with the keys ``'hits'``\ , ``'misses'``\ ,
+            ``'expired'``\ , ``'evictions'``\ , ``'invalidations'``\ , and
+            ``'size'``\ .  Empty if the cache is not enabled.
+        :rtype: dict
+        """
+        if self._query_cache is None:
+            return {}
+        out = dict(self._cache_stats)
+        out['size'] = len(self._query_cache)
+        return out
+
+    def _short_form(self, header):
+        """Normalize a program header to the short form of every mnemonic,
+        for example ``':format:border?'`` to ``'FORM:BORD?'``\ .  The short
+        form is the first four letters, or three if the fourth is a vowel.
+        """
+        header = header.strip().split(None, 1)[0].upper().lstrip(':')
+        query = header.endswith('?')
+        nodes = []
+        for node in header.rstrip('?').split(':'):
+            if node.startswith('*'):
+                nodes.append(node)
+                continue
+            mnemonic = node.rstrip('0123456789')
+            suffix = node[len(mnemonic):]
+            if len(mnemonic) > 4:
+                mnemonic = mnemonic[:3] if mnemonic[3] in 'AEIOU' else mnemonic[:4]
+            nodes.append(mnemonic + suffix)
+        out = ':'.join(nodes) + ('?' if query else '')
+        return out
+
+    def _subsystem(self, header):
+        """The root mnemonic of a short-form header, without numeric suffix.
+        Optional default roots (see :attr:`DEFAULT_NODES`) are skipped, so
+        that ``'VOLT'`` and ``'SOUR1:VOLT?'`` are both in ``'VOLT'``\ .
+        """
+        nodes = [n.rstrip('?').rstrip('0123456789') for n in header.split(':')]
+        if len(nodes) > 1 and nodes[0] in self.DATA.get('default_nodes', self.DEFAULT_NODES):
+            return nodes[1]
+        return nodes[0]
+
+    def _cache_key(self, scpi_string):
+        parts = scpi_string.strip().split(None, 1)
+        out = ' '.join([self._short_form(parts[0])] + [p.upper() for p in parts[1:]])
+        return out
+
+    def _cached_query(self, scpi_string):
+        """Returns the cached response to ``scpi_string``\ , or ``None``\ .
+        """
+        key = self._cache_key(scpi_string)
+        entry = self._query_cache.get(key)
+        if entry is None:
+            return None
+        response, expires = entry
+        if expires is not None and time.time() >= expires:
+            del self._query_cache[key]
+            self._cache_stats['expired'] += 1
+            return None
+        # Mark as most recently used
+        del self._query_cache[key]
+        self._query_cache[key] = entry
+        return response
+
+    def _cache_response(self, scpi_string, response):
+        ttl = self._cache_ttls[self._short_form(scpi_string)]
+        expires = None if ttl is None else time.time() + ttl
+        self._query_cache[self._cache_key(scpi_string)] = (response, expires)
+        while len(self._query_cache) > self._cache_size:
+            self._query_cache.popitem(last=False)
+            self._cache_stats['evictions'] += 1
+
+    def _invalidate_cache(self, scpi_string):
+        """Drop cached responses of the subsystems touched by the program
+        commands in ``scpi_string``\ .
+        """
+        subsystems = set()
+        for command in scpi_string.split(';'):
+            if not command.strip() or '?' in command:
+                continue
+            header = self._short_form(command)
+            if header in self.CACHE_RESETTING_COMMANDS:
+                self._cache_stats['invalidations'] += len(self._query_cache)
+                self._query_cache.clear()
+                return
+            if header.startswith('*'):
+                continue
+            subsystems.add(self._subsystem(header))
+        if not subsystems:
+            return
+        for key in self._query_cache.keys():
+            if self._subsystem(key) in subsystems:
+                del self._query_cache[key]
+                self._cache_stats['invalidations'] += 1
+
+    def _is_query(self, scpi_string):
+        """Returns ``True`` if the header of the last command in
+        ``scpi_string`` ends with a '?'.  Parameters may follow the header, as
+        in ``':fetch:arr? (@1,2)'``\ .
+        """
+        commands = scpi_string.strip().split(';')[-1].split()
+        return bool(commands) and commands[0].endswith('?')
+
     def ask_ascii(self, scpi_string):
         """A convenience function for calling :meth:`.write` and
         :meth:`.read_ascii` consecutively.  Up to 4096 bytes are read from
@@ -204,12 +735,21 @@ class SCPIInstrument(object):
             A valid SCPI query command. See the instrument's SCPI command reference.
 
         :raises Exception:
-            If the SCPI command does not end with a '?' (i.e. not a query command)
+            If the header of the last SCPI command does not end with a '?'
+            (i.e. not a query command)
         """
-        if scpi_string.strip()[-1] != '?':
-            raise Exception, 'The scpi_string argument for ask_* functions must be a query, i.e. end with a ?'
-        self.write(scpi_string)
-        return self.read_ascii()
+        if not self._is_query(scpi_string):
+            raise Exception, 'The scpi_string argument for ask_* functions must be a query, i.e. have a header ending with a ?'
+        if self._query_cache is None or self._short_form(scpi_string) not in self._cache_ttls:
+            return self._query(scpi_string, self.read_ascii)
+        out = self._cached_query(scpi_string)
+        if out is not None:
+            self._cache_stats['hits'] += 1
+            return out
+        self._cache_stats['misses'] += 1
+        out = self._query(scpi_string, self.read_ascii)
+        self._cache_response(scpi_string, out)
+        return out
 
     def ask_binary(self, scpi_string):
         """A convenience function for calling :meth:`.write` and
@@ -219,12 +759,12 @@ class SCPIInstrument(object):
             A valid SCPI query command. See the instrument's SCPI command reference.
 
         :raises Exception:
-            If the SCPI command does not end with a '?' (i.e. not a query command)
+            If the header of the last SCPI command does not end with a '?'
+            (i.e. not a query command)
         """
-        if scpi_string.strip()[-1] != '?':
-            raise Exception, 'The scpi_string argument for ask_* functions must be a query, i.e. end with a ?'
-        self.write(scpi_string)
-        return self.read_binary()
+        if not self._is_query(scpi_string):
+            raise Exception, 'The scpi_string argument for ask_* functions must be a query, i.e. have a header ending with a ?'
+        return self._query(scpi_string, self.read_binary)
 
     def ask_ieee754(self, scpi_string):
         """A convenience function for calling :meth:`.write` and
@@ -234,12 +774,12 @@ class SCPIInstrument(object):
             A valid SCPI query command. See the instrument's SCPI command reference.
 
         :raises Exception:
-            If the SCPI command does not end with a '?' (i.e. not a query command)
+            If the header of the last SCPI command does not end with a '?'
+            (i.e. not a query command)
         """
-        if scpi_string.strip()[-1] != '?':
-            raise Exception, 'The scpi_string argument for ask_* functions must be a query, i.e. end with a ?'
-        self.write(scpi_string)
-        return self.read_ieee754()
+        if not self._is_query(scpi_string):
+            raise Exception, 'The scpi_string argument for ask_* functions must be a query, i.e. have a header ending with a ?'
+        return self._query(scpi_string, self.read_ieee754)
 
 
 class GPIBInstrument(SCPIInstrument):
@@ -250,19 +790,20 @@ class GPIBInstrument(SCPIInstrument):
             A nickname associated with a GPIB primary address and defined in
             ``/etc/gpib.conf``.
         """
-        self.__device = gpib.find(nickname)
+        self._device = gpib.find(nickname)
         if reset:
             self.reset()
+        self._initialize()
 
     def __del__(self):
         """Close the GPIB conection.
         """
-        gpib.close(self.__device)
+        gpib.close(self._device)
 
     def reset(self):
         """Reset the GPIB instrument.
         """
-        gpib.clear(self.__device)
+        gpib.clear(self._device)
         self.write('*RST')
 
     def write(self, scpi_string):
@@ -272,7 +813,15 @@ class GPIBInstrument(SCPIInstrument):
         :param str scpi_string:
             A valid SCPI command. See the instrument's SCPI command reference.
         """
-        s = ''.join([scpi_string, '\n'])
+        payload = self._coalesce(scpi_string)
+        out = 0
+        if payload is not None:
+            out = self._write_payload(payload)
+        self._command_sent(scpi_string)
+        return out
+
+    def _write_payload(self, payload):
+        s = ''.join([payload, '\n'])
         return gpib.write(self._device, s)
 
     def read(self, bufsize=4096):
@@ -290,27 +839,259 @@ class GPIBInstrument(SCPIInstrument):
             Response from the instrument.
         :rtype: str
         """
+        self.flush()
         return gpib.read(self._device, bufsize)
 
 
+class GPIBGroup(object):
+    """A group of :class:`GPIBInstrument`\ s sharing one GPIB bus.  All
+    members are triggered by a single Group Execute Trigger (GET) and their
+    responses are collected as each member raises a service request (SRQ).
+    """
+    #: Keys for ``gpib.ask`` (``ibask``).
+    IBA_PAD = 0x0001
+    IBA_BNA = 0x0200
+
+    #: GPIB multiline command bytes.
+    UNL = 0x3F
+    LAD = 0x20
+    GET = 0x08
+
+    #: ``ibwait`` mask bits and the SRQ bus line bit.
+    SRQI = 0x1000
+    TIMO = 0x4000
+    BUS_SRQ = 0x2000
+
+    #: Request Service (RQS) bit of the status byte.
+    RQS = 0x40
+
+    def __init__(self, instruments, sre_mask=0x10):
+        """Initialize a group of GPIB instruments.
+
+        :param list instruments:
+            The :class:`GPIBInstrument`\ s to be triggered together.  They must
+            all be on the same GPIB board.
+        :param int sre_mask:
+            Defaults to ``0x10`` (Message Available).  Written to each
+            instrument's Service Request Enable register so that it raises SRQ
+            when its response is ready.
+
+        :raises Exception:
+            If the instruments are not on the same GPIB board.
+
+        .. code-block:: python
+
+            import microlab_instruments as mi
+
+            group = mi.GPIBGroup([mi.Arceus(), mi.Meloetta(), mi.Xerneas()])
+            group.trigger()
+            responses = group.collect()
+        """
+        self.instruments = list(instruments)
+        boards = set([gpib.ask(i._device, self.IBA_BNA) for i in self.instruments])
+        if len(boards) != 1:
+            raise Exception, 'Grouped GPIB instruments must share one board'
+        self.__board = boards.pop()
+        self.__addresses = [gpib.ask(i._device, self.IBA_PAD) for i in self.instruments]
+        for i in self.instruments:
+            i.write('*CLS')
+            i.write('*SRE {0}'.format(sre_mask))
+
+    def trigger(self):
+        """Trigger every instrument in the group with one Group Execute
+        Trigger.  All instruments are addressed to listen and the GET command
+        is sent in a single bus transaction.
+        """
+        for i in self.instruments:
+            i.flush()
+        commands = [self.UNL]
+        commands.extend([self.LAD + pad for pad in self.__addresses])
+        commands.append(self.GET)
+        gpib.command(self.__board, ''.join(map(chr, commands)))
+
+    def poll(self, pending=None):
+        """Serial-poll the instruments that are requesting service.  Polling
+        stops as soon as the SRQ line is released, so instruments that did not
+        raise SRQ are usually never polled.
+
+        :param list pending:
+            Defaults to all instruments in the group.  The instruments which
+            may still be requesting service.
+
+        :returns out:
+            The instruments that raised SRQ.
+        :rtype: list
+        """
+        if pending is None:
+            pending = self.instruments
+        out = []
+        for i in pending:
+            if not gpib.lines(self.__board) & self.BUS_SRQ:
+                break
+            if gpib.serial_poll(i._device) & self.RQS:
+                out.append(i)
+        return out
+
+    def collect(self, reader=None):
+        """Wait for every instrument in the group to raise SRQ and read its
+        response.
+
+        :param callable reader:
+            Defaults to :meth:`SCPIInstrument.read_ascii`.  Called with each
+            instrument to read its response, for example
+            ``lambda i: i.read_ieee754()``.
+
+        :returns out:
+            Responses in the same order as :attr:`instruments`.
+        :rtype: list
+
+        :raises Exception:
+            If the GPIB board times out while waiting for SRQ.
+        """
+        if reader is None:
+            reader = lambda i: i.read_ascii()
+        responses = {}
+        pending = list(self.instruments)
+        while pending:
+            gpib.wait(self.__board, self.SRQI | self.TIMO)
+            if not gpib.lines(self.__board) & self.BUS_SRQ:
+                raise Exception, 'Timeout while waiting for SRQ'
+            for i in self.poll(pending):
+                responses[id(i)] = reader(i)
+                pending.remove(i)
+        out = [responses[id(i)] for i in self.instruments]
+        return out
+
+
 class TCPIPInstrument(SCPIInstrument):
-    def __init__(self, socket_pair, reset=True):
-        """Initialize TCP/IP instrument.
+    #: Short-form headers that change the state of the instrument.  Queries
+    #: in which any command starts with one of them are not retried after a
+    #: reconnection.  ``SYST:ERR`` pops the error queue.
+    NON_IDEMPOTENT_QUERIES = ('READ', 'MEAS', 'INIT', '*TRG', 'SYST:ERR')
+
+    #: Socket errors that mean the connection is gone.  Other errors, such
+    #: as timeouts, are raised without reconnecting.
+    CONNECTION_ERRORS = (errno.ECONNRESET, errno.ECONNABORTED, errno.EPIPE,
+                         errno.ENOTCONN, errno.ETIMEDOUT, errno.EHOSTUNREACH,
+                         errno.ENETUNREACH)
+
+    def __init__(self, socket_pair, reset=True, reconnect_attempts=6,
+                 backoff=0.5, max_backoff=30, query_retries=2):
+        """Initialize TCP/IP instrument.  After the optional reset, the
+        commands in ``DATA['init_commands']`` are sent.  They are sent again
+        whenever the connection is re-established.
 
         :param tuple socket_pair:
             A 2-tuple of the form ``('192.168.1.2', 5025)``.
+        :param int reconnect_attempts:
+            Defaults to 6.  Number of times to try reconnecting after the
+            connection breaks before giving up.
+        :param float backoff:
+            Defaults to 0.5 seconds.  Delay before the first reconnection
+            attempt.  The delay doubles after every failed attempt.
+        :param float max_backoff:
+            Defaults to 30 seconds.  Upper limit of the delay between
+            reconnection attempts.
+        :param int query_retries:
+            Defaults to 2.  Number of times an idempotent ``ask_*`` query is
+            retried after a reconnection.
         """
-        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self._socket.connect(socket_pair)
-        self._socket.settimeout(30)
+        self._socket_pair = socket_pair
+        self.reconnect_attempts = reconnect_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.query_retries = query_retries
+        #: Number of times the connection was re-established.
+        self.reconnects = 0
+        #: Number of queries that were retried after a reconnection.
+        self.retries = 0
+        self._socket = None
+        self._connect()
         if reset:
             self.reset()
+        self._initialize()
 
     def __del__(self):
         """Close the socket connection properly.
         """
-        self._socket.shutdown(socket.SHUT_RDWR)
+        self._close()
+
+    def _connect(self):
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.connect(self._socket_pair)
+        self._socket.settimeout(30)
+
+    def _close(self):
+        if self._socket is None:
+            return
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            # The connection is already dead
+            pass
         self._socket.close()
+        self._socket = None
+
+    def reconnect(self):
+        """Close the connection and connect again, waiting longer after each
+        failed attempt, then send ``DATA['init_commands']`` again.  The query
+        cache is cleared, since a lost connection often means the instrument
+        rebooted and lost its settings.
+
+        :raises Exception:
+            If the instrument cannot be reached after
+            :attr:`reconnect_attempts` attempts.
+        """
+        self._close()
+        delay = self.backoff
+        for attempt in range(self.reconnect_attempts):
+            time.sleep(delay)
+            try:
+                self._connect()
+                break
+            except socket.error:
+                self._close()
+                delay = min(2 * delay, self.max_backoff)
+        else:
+            raise Exception, 'Could not reconnect to {0}:{1}'.format(*self._socket_pair)
+        self.reconnects += 1
+        self.clear_query_cache()
+        self._initialize()
+
+    def _is_connection_error(self, e):
+        return (not isinstance(e, socket.timeout) and
+                getattr(e, 'errno', None) in self.CONNECTION_ERRORS)
+
+    def _is_idempotent(self, scpi_string):
+        """Returns ``False`` if any command of the compound ``scpi_string``
+        starts with one of :attr:`NON_IDEMPOTENT_QUERIES`\ .
+        """
+        for command in scpi_string.split(';'):
+            if not command.strip():
+                continue
+            nodes = [n.rstrip('?').rstrip('0123456789')
+                     for n in self._short_form(command).split(':')]
+            for header in self.NON_IDEMPOTENT_QUERIES:
+                if nodes[:header.count(':') + 1] == header.split(':'):
+                    return False
+        return True
+
+    def _query(self, scpi_string, reader):
+        """Send the query and read its response.  If the connection breaks,
+        :meth:`.write` and :meth:`.read` reconnect, and idempotent queries
+        are sent again up to :attr:`query_retries` times.
+        """
+        attempt = 0
+        while True:
+            try:
+                return super(TCPIPInstrument, self)._query(scpi_string, reader)
+            except socket.error, e:
+                if (attempt >= self.query_retries or
+                        not self._is_connection_error(e) or
+                        not self._is_idempotent(scpi_string)):
+                    raise
+                attempt += 1
+                self.retries += 1
 
     def reset(self):
         """Reset the instrument.
@@ -320,20 +1101,88 @@ class TCPIPInstrument(SCPIInstrument):
 
     def write(self, scpi_string):
         """Write SCPI command to the instrument.  The end-of-string character
-        (for example, ``\\n``) is automatically appended.
+        (for example, ``\\n``) is automatically appended.  If the connection
+        is broken, it is re-established and the command is sent again.
 
         :param str scpi_string:
             A valid SCPI command. See the instrument's SCPI command reference.
         """
-        s = ''.join([scpi_string, '\n'])
-        total_bytes = len(s)
-        bytes_sent = 0
-        while bytes_sent < total_bytes:
-            sent = self._socket.send(s[bytes_sent:])
-            if sent == 0:
-                raise Exception, 'Socket connection broken'
-            bytes_sent += sent
-        return bytes_sent
+        payload = self._coalesce(scpi_string)
+        out = 0
+        if payload is not None:
+            out = self._write_payload(payload)
+        self._command_sent(scpi_string)
+        return out
+
+    def _write_payload(self, payload):
+        s = ''.join([payload, '\n'])
+        try:
+            return self._send(s)
+        except socket.error, e:
+            if not self._is_connection_error(e):
+                raise
+            self.reconnect()
+            return self._send(s)
+
+    def _send(self, s):
+        # sendall retries partial sends without re-slicing ``s``
+        self._socket.sendall(s)
+        return len(s)
+
+    def write_block(self, command, data, chunk_size=1 << 20):
+        """Write ``command`` followed by ``data`` as a definite-length block
+        (``#<n><length><data>``).  ``data`` is sent in ``chunk_size`` slices
+        of a zero-copy view, so it is never copied into one Python string.
+
+        :param str command:
+            The program header and any parameters before the block, including
+            the separator, for example ``':memory:data "WFM1:TEST",'``\ .
+        :param data:
+            A *str*\ , *bytearray*\ , ``array``\ , NumPy array, ``mmap``\ ,
+            or byte-oriented *memoryview*\ .
+        :param int chunk_size:
+            Defaults to 1 MiB.  Size of each send.
+
+        :returns out:
+            Number of payload bytes sent.
+        :rtype: int
+
+        :raises socket.error:
+            If the connection breaks.  The block is not resent.
+        """
+        if isinstance(data, memoryview):
+            if data.itemsize != 1:
+                data = data.tobytes()
+            view = lambda offset: data[offset:offset+chunk_size]
+            total_bytes = len(data)
+        else:
+            view = lambda offset: buffer(data, offset, chunk_size)
+            total_bytes = len(buffer(data))
+        self.flush()
+        length = str(total_bytes)
+        header = '{0}#{1}{2}'.format(command, len(length), length)
+        self._socket.sendall(header)
+        for offset in xrange(0, total_bytes, chunk_size):
+            self._socket.sendall(view(offset))
+        self._socket.sendall('\n')
+        self._command_sent(command)
+        return total_bytes
+
+    def write_block_from_file(self, command, filename, chunk_size=1 << 20):
+        """Like :meth:`.write_block`\ , but the data is the content of
+        ``filename``\ , memory-mapped instead of read into memory.
+        """
+        fd = open(filename, 'rb')
+        try:
+            if os.fstat(fd.fileno()).st_size == 0:
+                return self.write_block(command, '', chunk_size)
+            data = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                return self.write_block(command, data, chunk_size)
+            finally:
+                data.close()
+        finally:
+            fd.close()
 
     def read(self, bufsize=4096):
         """Read ``bufsize`` bytes from instrument.  Using this low-level
@@ -349,8 +1198,720 @@ class TCPIPInstrument(SCPIInstrument):
         :returns out:
             Response from the instrument.
         :rtype: str
+
+        :raises socket.error:
+            If the connection is broken.  The connection is re-established
+            before raising, but the response is lost.
+        :raises socket.timeout:
+            If no response arrives in time.  The connection is kept.
         """
-        return self._socket.recv(bufsize)
+        self.flush()
+        try:
+            s = self._socket.recv(bufsize)
+            if not s:
+                raise socket.error(errno.ECONNRESET, 'Socket connection broken')
+        except socket.error, e:
+            if self._is_connection_error(e):
+                self.reconnect()
+            raise
+        return s
+
+
+class SpectrumAnalyzerInstrument(TCPIPInstrument):
+    """A TCP/IP spectrum analyzer whose ``DATA['init_commands']`` select
+    little-endian single-precision binary transfers (``:FORM REAL,32`` and
+    ``:FORM:BORD SWAP``).
+    """
+    def fetch_trace(self, trace=1):
+        """Fetch a trace and its frequency axis.  The amplitudes are
+        transferred in binary and decoded in one bulk operation.
+
+        :param int trace:
+            Defaults to 1.  The trace number.
+
+        :returns out:
+            A 2-tuple of the form ``(frequencies, amplitudes)``\ .  The
+            frequencies are in Hz and the amplitudes are in the current
+            amplitude unit of the analyzer.
+        :rtype: tuple
+
+        .. code-block:: python
+
+            import microlab_instruments as mi
+
+            darkrai = mi.Darkrai()
+            freq, ampl = darkrai.fetch_trace()
+        """
+        axis = self.ask_ascii(':sense:frequency:start?;:sense:frequency:stop?;:sense:sweep:points?')
+        start, stop, points = axis.strip().split(';')
+        start = float(start)
+        stop = float(stop)
+        points = int(float(points))
+
+        # Discard the newline character
+        stream = self.ask_binary(':trace:data? trace{0}'.format(trace))[:-1]
+        amplitudes = array('f')
+        amplitudes.fromstring(stream)
+        if sys.byteorder != 'little':
+            amplitudes.byteswap()
+
+        step = (stop - start) / (points - 1) if points > 1 else 0.0
+        frequencies = array('d', [start + n * step for n in xrange(len(amplitudes))])
+        out = (frequencies, amplitudes)
+        return out
+
+
+class LogicAnalyzerInstrument(TCPIPInstrument):
+    """A logic analyzer whose captures are exported as a definite-length
+    block of fixed-width samples.  The query that exports a window of samples
+    is ``DATA['capture_query']``\ , followed by ``start`` and, if given,
+    ``stop``\ .
+    Each sample is ``DATA['sample_bytes']`` bytes, little-endian.
+    """
+    #: ``array`` typecodes by bus width in bits.
+    TYPECODES = ((8, 'B'), (16, 'H'), (32, 'I'), (64, 'L'))
+
+    def fetch_capture(self, buses, start=0, stop=None, chunk_samples=65536):
+        """Stream a capture from the analyzer and split it into buses.  The
+        block is read and decoded ``chunk_samples`` samples at a time, so the
+        raw capture is never held in memory at once.
+
+        :param dict buses:
+            Maps bus names to ``(bit_offset, width)`` within a sample.
+        :param int start:
+            Defaults to 0.  First sample to fetch.
+        :param int stop:
+            Defaults to ``None``, meaning the last sample.  The sample after
+            the last one to fetch.
+        :param int chunk_samples:
+            Defaults to 65536.  Rounded down to a multiple of 8.
+
+        :returns out:
+            A 2-tuple of the form ``(samples, data)``\ .  ``data`` maps each bus
+            name to an array of its values.  1-bit buses are bit-packed, most
+            significant bit first, as by ``numpy.packbits``\ .  The other buses
+            use the smallest unsigned type that fits their width.  NumPy arrays
+            are returned if NumPy is installed, and ``array``\ s otherwise.
+        :rtype: tuple
+
+        .. code-block:: python
+
+            import numpy as np
+            import microlab_instruments as mi
+
+            heatran = mi.Heatran()
+            n, data = heatran.fetch_capture({'ADDR': (0, 16), 'CLK': (16, 1)},
+                                            start=1000000, stop=2000000)
+            clk = np.unpackbits(data['CLK'])[:n]
+        """
+        sample_bytes = self.DATA['sample_bytes']
+        chunk_samples = max(8, chunk_samples - chunk_samples % 8)
+        window = [start] if stop is None else [start, stop]
+        query = '{0} {1}'.format(self.DATA['capture_query'],
+                                 ','.join([str(n) for n in window]))
+        self.write(query)
+
+        # Read the block header
+        s = self._read_exactly(2)
+        if s[0] != '#':
+            raise Exception, 'Expected a definite-length block'
+        remaining = int(self._read_exactly(int(s[1])))
+        samples = remaining / sample_bytes
+
+        chunks = dict((name, []) for name in buses)
+        while remaining:
+            chunk = self._read_exactly(min(remaining, chunk_samples * sample_bytes))
+            remaining -= len(chunk)
+            for name, values in self._split_buses(chunk, sample_bytes, buses).items():
+                chunks[name].append(values)
+        # Discard the newline character
+        self._read_exactly(1)
+
+        data = {}
+        for name, values in chunks.items():
+            if np is not None:
+                data[name] = np.concatenate(values) if values else np.zeros(0, np.uint8)
+            else:
+                data[name] = values[0] if values else array('B')
+                for v in values[1:]:
+                    data[name].extend(v)
+        out = (samples, data)
+        return out
+
+    def _split_buses(self, chunk, sample_bytes, buses):
+        """Split a chunk of raw samples into packed per-bus arrays.
+        """
+        out = {}
+        if np is not None:
+            raw = np.frombuffer(chunk, dtype=np.uint8).reshape(-1, sample_bytes)
+            words = np.zeros(len(raw), dtype=np.uint64)
+            for n in range(sample_bytes):
+                words |= raw[:, n].astype(np.uint64) << np.uint64(8 * n)
+            for name, (offset, width) in buses.items():
+                values = (words >> np.uint64(offset)) & np.uint64((1 << width) - 1)
+                if width == 1:
+                    out[name] = np.packbits(values.astype(np.uint8))
+                else:
+                    dtype = 'uint{0}'.format(self._container_bits(width))
+                    out[name] = values.astype(dtype)
+            return out
+
+        raw = array('B', chunk)
+        words = [sum(raw[i + n] << (8 * n) for n in range(sample_bytes))
+                 for i in xrange(0, len(raw), sample_bytes)]
+        for name, (offset, width) in buses.items():
+            mask = (1 << width) - 1
+            values = [(w >> offset) & mask for w in words]
+            if width == 1:
+                packed = array('B')
+                for i in xrange(0, len(values), 8):
+                    byte = 0
+                    for bit in values[i:i+8]:
+                        byte = (byte << 1) | bit
+                    byte <<= 8 - len(values[i:i+8])
+                    packed.append(byte)
+                out[name] = packed
+            else:
+                bits = self._container_bits(width)
+                typecode = dict(self.TYPECODES)[bits]
+                out[name] = array(typecode, values)
+        return out
+
+    def _container_bits(self, width):
+        for bits, typecode in self.TYPECODES:
+            if width <= bits:
+                return bits
+        raise Exception, 'Buses wider than 64 bits are not supported'
+
+
+class SignalGeneratorInstrument(TCPIPInstrument):
+    """An Agilent MXG signal generator with a list sweep.  The whole list is
+    uploaded at once and stepped by the instrument, so no per-point commands
+    are needed.
+    """
+    #: Bit of the Standard Operation condition register that is set while
+    #: a sweep is running.
+    SWEEPING = 0x08
+
+    def upload_list_sweep(self, frequencies, powers=None, dwell=None):
+        """Upload a list sweep in a single write.
+
+        :param list frequencies:
+            Frequencies in Hz.
+        :param list powers:
+            Defaults to ``None``, which keeps the power fixed.  Powers in dBm,
+            either one per frequency or a single value for all points.
+        :param dwell:
+            Defaults to ``None``, which keeps the current dwell time.  Either
+            a *float* in seconds for all points, or a *list* with one dwell
+            time per frequency.
+
+        :raises Exception:
+            If ``powers`` or ``dwell`` are lists of a different length than
+            ``frequencies``\ .
+        """
+        n = len(frequencies)
+        for values in (powers, dwell):
+            if isinstance(values, (list, tuple)) and len(values) not in (1, n):
+                raise Exception, 'powers and dwell must have one value per frequency'
+        fmt = lambda values: ','.join(['{0:.12g}'.format(v) for v in values])
+        commands = [':list:type list',
+                    ':list:frequency {0}'.format(fmt(frequencies)),
+                    ':frequency:mode list']
+        if powers is not None:
+            if not isinstance(powers, (list, tuple)):
+                powers = [powers]
+            commands.append(':list:power {0}'.format(fmt(powers)))
+            commands.append(':power:mode list')
+        if dwell is not None:
+            if isinstance(dwell, (list, tuple)):
+                commands.append(':list:dwell {0}'.format(fmt(dwell)))
+                commands.append(':list:dwell:type list')
+            else:
+                commands.append(':sweep:dwell {0:.12g}'.format(dwell))
+                commands.append(':list:dwell:type step')
+        self.write(';'.join(commands))
+
+    def run_list_sweep(self, point_trigger='EXT', sweep_trigger='IMM', continuous=False):
+        """Arm the uploaded list sweep.
+
+        :param str point_trigger:
+            Defaults to ``'EXT'``\ , so each point is stepped by a hardware
+            trigger.  Use ``'IMM'`` to step by dwell time, or ``'BUS'`` to step
+            with ``*TRG``\ .
+        :param str sweep_trigger:
+            Defaults to ``'IMM'``\ .  What starts the whole sweep.
+        :param bool continuous:
+            Defaults to ``False``\ , which runs the sweep once.
+
+        .. code-block:: python
+
+            import microlab_instruments as mi
+
+            ho_oh = mi.Ho_oh()
+            ho_oh.upload_list_sweep([1e9, 1.1e9, 1.2e9], powers=-10, dwell=0.01)
+            ho_oh.run_list_sweep(point_trigger='IMM')
+            ho_oh.wait_for_sweep()
+        """
+        commands = [':list:trigger:source {0}'.format(point_trigger),
+                    ':trigger:source {0}'.format(sweep_trigger),
+                    ':output on',
+                    ':initiate:continuous {0}'.format('on' if continuous else 'off')]
+        if not continuous:
+            commands.append(':initiate')
+        self.write(';'.join(commands))
+
+    def upload_waveform(self, name, iq, chunk_size=1 << 20):
+        """Upload an ARB waveform to volatile waveform memory.
+
+        :param str name:
+            Name of the waveform, as in ``WFM1:<name>``\ .
+        :param iq:
+            Interleaved I/Q samples as big-endian signed 16-bit integers, in
+            any form accepted by :meth:`.write_block`\ .  See
+            :meth:`.upload_waveform_from_file` for samples in a file.
+        :param int chunk_size:
+            Defaults to 1 MiB.  See :meth:`.write_block`\ .
+
+        .. code-block:: python
+
+            import numpy as np
+            import microlab_instruments as mi
+
+            ho_oh = mi.Ho_oh()
+            iq = np.zeros(2 * 100000, dtype='>i2')
+            iq[0::2] = 32767 * np.cos(np.linspace(0, 200 * np.pi, 100000))
+            ho_oh.upload_waveform('TONE', iq)
+        """
+        command = ':memory:data "WFM1:{0}",'.format(name)
+        return self.write_block(command, iq, chunk_size)
+
+    def upload_waveform_from_file(self, name, filename, chunk_size=1 << 20):
+        """Like :meth:`.upload_waveform`\ , but the I/Q samples are the
+        content of ``filename``\ , which is memory-mapped instead of read
+        into memory.
+
+        .. code-block:: python
+
+            ho_oh.upload_waveform_from_file('CAPTURE', 'capture.iq')
+        """
+        command = ':memory:data "WFM1:{0}",'.format(name)
+        return self.write_block_from_file(command, filename, chunk_size)
+
+    def is_sweeping(self):
+        """Returns ``True`` while the list sweep is running.
+        """
+        condition = int(self.ask_ascii(':status:operation:condition?'))
+        return bool(condition & self.SWEEPING)
+
+    def wait_for_sweep(self):
+        """Block until the list sweep is complete.
+        """
+        self.ask_ascii('*OPC?')
+
+
+class SourceMeasureInstrument(TCPIPInstrument):
+    """An Agilent B29xx source/measure unit.  Long measurements are logged by
+    the instrument into its trace buffer on timed triggers, and read back in
+    large binary blocks, so the sample rate is not limited by round trips.
+    """
+    #: Number of readings the trace buffer of one channel can hold.
+    TRACE_BUFFER_SIZE = 100000
+
+    #: Measurement functions that must be turned on to log an element.
+    SENSE_FUNCTIONS = ('VOLT', 'CURR', 'RES')
+
+    #: Bit of the Standard Operation condition register that is set while
+    #: the acquisition of each channel is idle.
+    ACQUIRE_IDLE = {1: 1 << 4, 2: 1 << 10}
+
+    def configure_channels(self, levels, limits, function='VOLT', channels=(1, 2),
+                           output=True):
+        """Configure the source of several channels in one write.
+
+        :param tuple levels:
+            Source level of each channel, in volts or amperes.
+        :param tuple limits:
+            Compliance of each channel, in amperes when sourcing voltage and
+            in volts when sourcing current.
+        :param str function:
+            Defaults to ``'VOLT'``\ .  ``'VOLT'`` or ``'CURR'``\ .
+        :param tuple channels:
+            Defaults to ``(1, 2)``\ .
+        :param bool output:
+            Defaults to ``True``\ .  Turn the outputs on.
+
+        :raises Exception:
+            If ``levels`` or ``limits`` do not have one value per channel.
+        """
+        if len(levels) != len(channels) or len(limits) != len(channels):
+            raise Exception, 'levels and limits must have one value per channel'
+        function = function.upper()[:4]
+        limited = 'CURR' if function == 'VOLT' else 'VOLT'
+        commands = []
+        for channel, level, limit in zip(channels, levels, limits):
+            commands.extend([':source{0}:function:mode {1}'.format(channel, function),
+                             ':source{0}:{1} {2:.12g}'.format(channel, function, level),
+                             ':sense{0}:{1}:protection {2:.12g}'.format(channel, limited, limit)])
+            if output:
+                commands.append(':output{0} on'.format(channel))
+        self.write(';'.join(commands))
+
+    def _channel_list(self, channels):
+        return '(@{0})'.format(','.join([str(c) for c in channels]))
+
+    def trigger_channels(self, channels=(1, 2)):
+        """Start the source and measurement of ``channels`` with one
+        ``:initiate``\ , so that they run together.
+        """
+        self.write(':initiate {0}'.format(self._channel_list(channels)))
+
+    def fetch_channels(self, channels=(1, 2), elements=('VOLT', 'CURR')):
+        """Wait for the triggered measurements to complete, then fetch the
+        readings of all ``channels`` with one binary query.
+
+        :param tuple channels:
+            Defaults to ``(1, 2)``\ .
+        :param tuple elements:
+            Defaults to ``('VOLT', 'CURR')``\ .  Values fetched per reading.
+
+        :returns out:
+            A mapping of each channel to a mapping of each element to an
+            ``array('d')`` of its readings.
+        :rtype: dict
+
+        .. code-block:: python
+
+            import microlab_instruments as mi
+
+            yveltal = mi.Yveltal()
+            yveltal.configure_channels(levels=(1.0, 0.5), limits=(0.01, 0.01))
+            yveltal.trigger_channels()
+            data = yveltal.fetch_channels()
+            print data[1]['CURR'], data[2]['CURR']
+        """
+        elements = [e.upper() for e in elements]
+        with self._interleaved(len(channels) * len(elements)):
+            values = self.ask_ieee754(';'.join([
+                ':format:elements:sense {0}'.format(','.join(elements)),
+                '*WAI',
+                ':fetch:array? {0}'.format(self._channel_list(channels))]))
+        # Readings are ordered by point, then by channel, then by element
+        stride = len(channels) * len(elements)
+        out = {}
+        for j, channel in enumerate(channels):
+            out[channel] = {}
+            for k, element in enumerate(elements):
+                out[channel][element] = array('d', values[j * len(elements) + k::stride])
+        return out
+
+    def start_logging(self, count, interval, channel=1, elements=('CURR',)):
+        """Clear the trace buffer of ``channel`` and start logging ``count``
+        readings, one every ``interval`` seconds.  The source output must
+        already be configured and turned on.
+
+        :param int count:
+            Number of readings.  At most :attr:`TRACE_BUFFER_SIZE`\ , because
+            the buffer stops filling when it is full.
+        :param float interval:
+            Seconds between readings.
+        :param int channel:
+            Defaults to 1.
+        :param tuple elements:
+            Defaults to ``('CURR',)``\ .  Values stored per reading, from
+            ``'VOLT'``\ , ``'CURR'``\ , ``'RES'``\ , ``'TIME'``\ ,
+            ``'STAT'``\ , and ``'SOUR'``\ .
+
+        :raises Exception:
+            If ``count`` does not fit in the trace buffer.
+
+        .. code-block:: python
+
+            import microlab_instruments as mi
+
+            yveltal = mi.Yveltal()
+            yveltal.write(':source1:voltage 1.5;:output1 on')
+            yveltal.start_logging(100000, 1e-3, elements=('CURR', 'TIME'))
+            fd = open('current.txt', 'w')
+            for readings in yveltal.log():
+                for current, timestamp in readings:
+                    fd.write('{0} {1}\\n'.format(timestamp, current))
+            fd.close()
+        """
+        if count > self.TRACE_BUFFER_SIZE:
+            raise Exception, 'At most {0} readings fit in the trace buffer'.format(self.TRACE_BUFFER_SIZE)
+        elements = [e.upper() for e in elements]
+        functions = ','.join(['"{0}"'.format(e) for e in elements
+                              if e in self.SENSE_FUNCTIONS])
+        commands = [':trace{0}:feed:control never'.format(channel),
+                    ':trace{0}:clear'.format(channel),
+                    ':trace{0}:points {1}'.format(channel, count),
+                    ':trace{0}:feed sense'.format(channel),
+                    ':trace{0}:feed:control next'.format(channel),
+                    ':format:elements:sense {0}'.format(','.join(elements)),
+                    ':trigger{0}:acquire:source timer'.format(channel),
+                    ':trigger{0}:acquire:timer {1:.12g}'.format(channel, interval),
+                    ':trigger{0}:acquire:count {1}'.format(channel, count),
+                    ':initiate:acquire (@{0})'.format(channel)]
+        if functions:
+            commands.insert(0, ':sense{0}:function:on {1}'.format(channel, functions))
+        self.write(';'.join(commands))
+        self._logs = getattr(self, '_logs', {})
+        self._logs[channel] = {
+            'count'    : count,
+            'elements' : len(elements),
+            'pointer'  : 0,
+            'stopped'  : False,
+            }
+
+    def read_log(self, channel=1, max_readings=10000):
+        """Read the readings logged since the last call, without waiting.
+
+        :param int channel:
+            Defaults to 1.
+        :param int max_readings:
+            Defaults to 10000.  Maximum number of readings per block.
+
+        :returns out:
+            A *list* of the new readings.  Each reading is a *float* if one
+            element is logged, or a *tuple* in the order of ``elements``
+            otherwise.
+        :rtype: list
+        """
+        log = self._logs[channel]
+        logged = int(self.ask_ascii(':trace{0}:points:actual?'.format(channel)))
+        size = min(logged - log['pointer'], max_readings)
+        if size <= 0:
+            return []
+        with self._interleaved(log['elements']):
+            values = self.ask_ieee754(':trace{0}:data? {1},{2}'.format(channel, log['pointer'], size))
+        log['pointer'] += size
+        if log['elements'] == 1:
+            return values
+        out = zip(*[iter(values)] * log['elements'])
+        return out
+
+    def log(self, channel=1, max_readings=10000, poll=0.1):
+        """A generator that yields blocks of new readings, as returned by
+        :meth:`.read_log`\ , until all ``count`` readings have been read.  It
+        also stops once the readings logged so far have been read, if
+        logging ended early: after :meth:`.stop_logging`\ , or when the
+        acquisition of ``channel`` is idle, for example after a compliance
+        abort.
+
+        :param float poll:
+            Defaults to 0.1 seconds.  Wait between reads when no new readings
+            are available.
+        """
+        log = self._logs[channel]
+        idle = False
+        while log['pointer'] < log['count']:
+            readings = self.read_log(channel, max_readings)
+            if readings:
+                yield readings
+                continue
+            if idle:
+                # Nothing was logged since the acquisition ended
+                return
+            idle = log['stopped'] or self.is_acquire_idle(channel)
+            if not idle:
+                time.sleep(poll)
+
+    def is_acquire_idle(self, channel=1):
+        """Returns ``True`` if the acquisition of ``channel`` is not running,
+        so no more readings will be logged.
+        """
+        condition = int(self.ask_ascii(':status:operation:condition?'))
+        return bool(condition & self.ACQUIRE_IDLE[channel])
+
+    def stop_logging(self, channel=1):
+        """Abort the logging triggers and stop filling the trace buffer.  The
+        readings already logged can still be read with :meth:`.read_log`\ ,
+        and :meth:`.log` stops after yielding them.
+        """
+        self.write(';'.join([':abort:acquire (@{0})'.format(channel),
+                             ':trace{0}:feed:control never'.format(channel)]))
+        if channel in getattr(self, '_logs', {}):
+            self._logs[channel]['stopped'] = True
+
+
+class NetworkAnalyzerInstrument(SCPIInstrument):
+    """A network analyzer that transfers S-parameters as interleaved
+    real/imaginary pairs of double-precision floating-point numbers.  Combine
+    it with a transport class, for example::
+
+        class Zygarde(NetworkAnalyzerInstrument, TCPIPInstrument):
+            ...
+
+    ``DATA['init_commands']`` must select 64-bit binary transfers.  The
+    default hooks below follow the SCPI commands of the Agilent E5071C; other
+    models override them.
+    """
+    def fetch_sparameters(self, sparams=('S11', 'S21', 'S12', 'S22')):
+        """Fetch several S-parameter traces and the stimulus axis.  If
+        ``DATA['compound_blocks']`` is ``True``\ , all traces are requested in
+        one compound query and read back in one exchange.
+
+        :param tuple sparams:
+            Defaults to all four 2-port S-parameters.
+
+        :returns out:
+            A 2-tuple of the form ``(stimulus, traces)``\ .  ``stimulus`` is
+            the frequency axis in Hz and ``traces`` maps each S-parameter to
+            its complex values.  These are NumPy arrays if NumPy is installed,
+            or an ``array('d')`` and *list*\ s of *complex* otherwise.
+        :rtype: tuple
+
+        .. code-block:: python
+
+            import microlab_instruments as mi
+
+            zygarde = mi.Zygarde()
+            freq, s = zygarde.fetch_sparameters(('S11', 'S21'))
+            print abs(s['S21'])
+        """
+        stimulus = self._fetch_stimulus()
+        self._prepare_traces(len(sparams))
+        queries = [self._sparameter_query(n + 1, sparam)
+                   for n, sparam in enumerate(sparams)]
+        traces = {}
+        if self.DATA.get('compound_blocks'):
+            self.write(';'.join(queries))
+            for sparam in sparams:
+                traces[sparam] = self._read_complex_block()
+        else:
+            for sparam, query in zip(sparams, queries):
+                self.write(query)
+                traces[sparam] = self._read_complex_block()
+        out = (stimulus, traces)
+        return out
+
+    def _fetch_stimulus(self):
+        """Returns the stimulus axis.
+        """
+        self.write(':sense1:frequency:data?')
+        return self._decode_doubles(self._read_block())
+
+    def _prepare_traces(self, count):
+        """Make sure at least ``count`` traces exist.
+        """
+        self.write(':calculate1:parameter:count {0}'.format(count))
+
+    def _sparameter_query(self, index, sparam):
+        """Returns the commands that assign ``sparam`` to trace ``index``\ ,
+        select it, and query its complex data.
+        """
+        return ':calculate1:parameter{0}:define {1};:calculate1:parameter{0}:select;:calculate1:data:sdata?'.format(index, sparam)
+
+    def _read_block(self):
+        """Read one definite-length block and the separator (``;`` or
+        ``\\n``) that follows it.
+
+        :rtype: str
+        """
+        s = self._read_exactly(2)
+        if s[0] != '#':
+            raise Exception, 'Expected a definite-length block'
+        size = int(self._read_exactly(int(s[1])))
+        out = self._read_exactly(size)
+        self._read_exactly(1)
+        return out
+
+    def _read_complex_block(self):
+        """Read one block of interleaved real/imaginary pairs.
+        """
+        return self._decode_complex(self._read_block())
+
+    def _decode_doubles(self, stream):
+        """Decode ``stream`` of doubles in the byte order selected at init.
+        """
+        little = self.DATA['byte_order_little'] == 'SWAP'
+        if np is not None:
+            return np.frombuffer(stream, dtype='<f8' if little else '>f8')
+        out = array('d')
+        out.fromstring(stream)
+        if little != (sys.byteorder == 'little'):
+            out.byteswap()
+        return out
+
+    def _decode_complex(self, stream):
+        """Decode ``stream`` of interleaved real/imaginary doubles.
+        """
+        values = self._decode_doubles(stream)
+        if np is not None:
+            return values[0::2] + 1j * values[1::2]
+        out = [complex(r, i) for r, i in zip(values[0::2], values[1::2])]
+        return out
+
+
+class BusScheduler(object):
+    """Serializes access to a bus shared by several threads.  Only one thread
+    holds the bus at a time.  When the bus is released it is handed to the
+    waiting thread with the highest priority, and to the longest-waiting one
+    among equal priorities.  A thread that already holds the bus may
+    reacquire it, so that nested transactions form one atomic sequence.
+    """
+    #: Priorities.  Lower values are served first.
+    HIGH = 0
+    NORMAL = 1
+    LOW = 2
+
+    def __init__(self):
+        self.__condition = threading.Condition(threading.Lock())
+        self.__owner = None
+        self.__depth = 0
+        self.__waiting = []
+        self.__sequence = itertools.count()
+
+    def acquire(self, priority=None):
+        """Wait until the bus is granted to the calling thread.
+
+        :param int priority:
+            Defaults to :attr:`NORMAL`\ .
+        """
+        if priority is None:
+            priority = self.NORMAL
+        me = threading.current_thread()
+        with self.__condition:
+            if self.__owner is me:
+                self.__depth += 1
+                return
+            entry = (priority, next(self.__sequence), me)
+            heapq.heappush(self.__waiting, entry)
+            while self.__owner is not None or self.__waiting[0] is not entry:
+                self.__condition.wait()
+            heapq.heappop(self.__waiting)
+            self.__owner = me
+            self.__depth = 1
+
+    def release(self):
+        """Release the bus held by the calling thread.
+
+        :raises Exception:
+            If the calling thread does not hold the bus.
+        """
+        with self.__condition:
+            if self.__owner is not threading.current_thread():
+                raise Exception, 'Bus released by a thread that does not hold it'
+            self.__depth -= 1
+            if self.__depth == 0:
+                self.__owner = None
+                self.__condition.notify_all()
+
+    @contextmanager
+    def transaction(self, priority=None):
+        """A context manager that holds the bus for the duration of the
+        block.
+
+        :param int priority:
+            Defaults to :attr:`NORMAL`\ .  Ignored if the calling thread
+            already holds the bus.
+        """
+        self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
 
 
 class AardvarkInstrument(object):
@@ -392,11 +1953,26 @@ class AardvarkInstrument(object):
         # SPI configuration
         aapy.aa_spi_bitrate(self.__device, 1000)
         aapy.aa_spi_configure(self.__device, aapy.AA_SPI_POL_RISING_FALLING, aapy.AA_SPI_PHASE_SAMPLE_SETUP, aapy.AA_SPI_BITORDER_MSB)
+        self.__spi_xin = aapy.array_u08(25)
+        self.scheduler = BusScheduler()
         #self.__spi_test()
 
     def __del__(self):
         aapy.aa_close(self.__device)
 
+    def transaction(self, priority=None):
+        """Reserve the Aardvark for a sequence of I2C or SPI transfers that
+        must not be interleaved with those of other threads.  See
+        :meth:`BusScheduler.transaction`\ .
+
+        .. code-block:: python
+
+            with aa.transaction(mi.BusScheduler.HIGH):
+                aa.i2c_write(0x70, 0x04)
+                ret = aa.i2c_read(0x4A, 3)
+        """
+        return self.scheduler.transaction(priority)
+
     def __spi_test(self):
         TEST_MESSAGE = array('B', [randint(0x00, 0xFF) for n in range(25)])
         self.spi_write(TEST_MESSAGE)
@@ -427,7 +2003,32 @@ class AardvarkInstrument(object):
         """
         xout = aapy.array_u08(1)
         xout[0] = bytecode
-        status, bytes_sent = aapy.aa_i2c_write_ext(self.__device, address, aapy.AA_I2C_NO_FLAGS, xout)
+        with self.transaction():
+            status, bytes_sent = aapy.aa_i2c_write_ext(self.__device, address, aapy.AA_I2C_NO_FLAGS, xout)
+        if status == 0:
+            out = bytes_sent
+            return out
+        else:
+            raise Exception, self.I2C_STATUS_CODES[status]
+
+    def i2c_write_block(self, address, bytecodes):
+        """Write several ``bytecodes`` to the I2C slave with ``address`` in a
+        single I2C transaction.
+
+        :param int address:
+            Slave address to receive ``bytecodes``.  Limited to 8 bits.
+        :param list bytecodes:
+            Raw bytecodes to send.  Each is limited to 8 bits.
+
+        :returns out:
+            Number of bytes sent.
+        :rtype: int
+
+        :raises Exception: if the status response is not 0. See :attr:`.I2C_STATUS_CODES`.
+        """
+        xout = array('B', bytecodes)
+        with self.transaction():
+            status, bytes_sent = aapy.aa_i2c_write_ext(self.__device, address, aapy.AA_I2C_NO_FLAGS, xout)
         if status == 0:
             out = bytes_sent
             return out
@@ -449,7 +2050,8 @@ class AardvarkInstrument(object):
         :raises Exception: if the status response is not 0. See :attr:`.I2C_STATUS_CODES`.
         """
         xin = aapy.array_u08(bufsize)
-        status, data_recv, bytes_recv = aapy.aa_i2c_read_ext(self.__device, address, aapy.AA_I2C_NO_FLAGS, xin)
+        with self.transaction():
+            status, data_recv, bytes_recv = aapy.aa_i2c_read_ext(self.__device, address, aapy.AA_I2C_NO_FLAGS, xin)
         if status == 0:
             out = xin
             return out
@@ -476,7 +2078,8 @@ class AardvarkInstrument(object):
         xout = aapy.array_u08(1)
         xout[0] = bytecode
         xin = aapy.array_u08(bufsize)
-        status, bytes_sent, data_recv, bytes_recv = aapy.aa_i2c_write_read(self.__device, address, aapy.AA_I2C_NO_FLAGS, xout, xin)
+        with self.transaction():
+            status, bytes_sent, data_recv, bytes_recv = aapy.aa_i2c_write_read(self.__device, address, aapy.AA_I2C_NO_FLAGS, xout, xin)
         if status == 0:
             out = xin
             return out
@@ -497,46 +2100,261 @@ class AardvarkInstrument(object):
         :raises Exception: if ``bytecode`` does not have exactly 25 8-bit elements.
         """
         if isinstance(bytecode, list):
-            bits = [b.bit_length() for b in bytecode]
-            if all([length <= 8 for length in bits]):
+            try:
                 xout = array('B', bytecode)
-            else:
+            except OverflowError:
                 raise Exception, 'bytecode must be a 25-long array of bytes'
         elif isinstance(bytecode, array) and bytecode.typecode == 'B':
             xout = bytecode
         else:
             raise Exception, 'bytecode must be a 25-long array of bytes'
         xin = aapy.array_u08(25)
-        bytes_sent, data_recv = aapy.aa_spi_write(self.__device, xout, xin)
+        with self.transaction():
+            bytes_sent, data_recv = aapy.aa_spi_write(self.__device, xout, xin)
         out = xin
         return out
 
+    def spi_transfer(self, bytecode, chunk_size=None):
+        """Write ``bytecode`` of any length to, and read as many bytes from,
+        the SPI channel.  The bytes are not validated one by one, and the
+        receive buffer is reused between calls.
+
+        :param bytecode:
+            Raw bytecodes to send, as an ``array('B')``\ , *bytearray*\ ,
+            *memoryview*\ , or *str*\ .
+        :param int chunk_size:
+            Defaults to ``None``, which sends ``bytecode`` in one SPI
+            transaction.  Otherwise ``bytecode`` is split into back-to-back
+            transactions of at most ``chunk_size`` bytes.
+
+        :returns out:
+            Response bytes, as long as ``bytecode``\ .
+        :rtype: array
+
+        .. code-block:: python
+
+            import microlab_instruments as mi
+
+            aa = mi.Aardvark()
+            capture = aa.spi_transfer(bytearray(65536), chunk_size=4096)
+        """
+        if isinstance(bytecode, array) and bytecode.typecode == 'B':
+            xout = bytecode
+        elif isinstance(bytecode, memoryview):
+            xout = array('B', bytecode.tobytes())
+        elif isinstance(bytecode, (bytearray, str)):
+            xout = array('B', str(bytecode))
+        else:
+            raise Exception, 'bytecode must be an array of bytes'
+        total_bytes = len(xout)
+        if chunk_size is None or chunk_size >= total_bytes:
+            chunk_size = total_bytes
+        with self.transaction():
+            xin = self.__spi_buffer(chunk_size)
+            if chunk_size == total_bytes:
+                aapy.aa_spi_write(self.__device, (xout, total_bytes), (xin, total_bytes))
+                out = xin[:total_bytes]
+                return out
+            out = array('B')
+            for n in xrange(0, total_bytes, chunk_size):
+                chunk = xout[n:n+chunk_size]
+                aapy.aa_spi_write(self.__device, chunk, (xin, len(chunk)))
+                out.extend(xin[:len(chunk)])
+            return out
+
+    def __spi_buffer(self, bufsize):
+        """Return a receive buffer at least ``bufsize`` bytes long, reusing
+        the previous one if it is large enough.
+        """
+        xin = self.__spi_xin
+        if len(xin) < bufsize:
+            xin = aapy.array_u08(bufsize)
+            self.__spi_xin = xin
+        return xin
 
-class SerialInstrument(object):
-    def __init__(self, device_port):
+
+class SerialInstrument(SCPIInstrument):
+    def __init__(self, device_port, baudrate=9600, bytesize=8, parity='N',
+                 stopbits=1, xonxoff=False, rtscts=False, dsrdtr=False,
+                 timeout=30, reset=True):
         """Initialize an RS-232 instrument.
+
+        :param str device_port:
+            A serial port such as ``'/dev/ttyUSB0'``\ , or any URL accepted by
+            ``serial.serial_for_url``\ , for example ``'loop://'``\ .  A pty
+            slave such as ``'/dev/pts/3'`` can stand in for an instrument.
+        :param int baudrate:
+            Defaults to 9600.
+        :param int bytesize:
+            Defaults to 8 data bits.
+        :param str parity:
+            Defaults to ``'N'`` (none).  One of ``'N'``\ , ``'E'``\ , ``'O'``\ ,
+            ``'M'``\ , ``'S'``\ .
+        :param int stopbits:
+            Defaults to 1.
+        :param bool xonxoff:
+            Defaults to ``False``.  Enable software flow control.
+        :param bool rtscts:
+            Defaults to ``False``.  Enable RTS/CTS hardware flow control.
+        :param bool dsrdtr:
+            Defaults to ``False``.  Enable DSR/DTR hardware flow control.
+        :param float timeout:
+            Defaults to 30 seconds.  Read timeout.
         """
-        self.__serial = serial.Serial(device_port)
+        self._serial = serial.serial_for_url(device_port,
+                                             baudrate=baudrate,
+                                             bytesize=bytesize,
+                                             parity=parity,
+                                             stopbits=stopbits,
+                                             xonxoff=xonxoff,
+                                             rtscts=rtscts,
+                                             dsrdtr=dsrdtr,
+                                             timeout=timeout)
+        if reset:
+            self.reset()
 
     def __del__(self):
-        self.__serial.close()
+        """Close the serial port.
+        """
+        self._serial.close()
+
+    def reset(self):
+        """Reset the instrument.
+        """
+        self.write('*CLS')
+        self.write('*RST')
+
+    def write(self, scpi_string):
+        """Write SCPI command to the instrument.  The end-of-string character
+        (for example, ``\\n``) is automatically appended.
+
+        :param str scpi_string:
+            A valid SCPI command. See the instrument's SCPI command reference.
+        """
+        payload = self._coalesce(scpi_string)
+        out = 0
+        if payload is not None:
+            out = self._write_payload(payload)
+        self._command_sent(scpi_string)
+        return out
+
+    def _write_payload(self, payload):
+        s = ''.join([payload, '\n'])
+        return self._serial.write(s)
+
+    def _in_waiting(self):
+        """Number of bytes in the receive buffer of the serial port.
+        """
+        try:
+            return self._serial.in_waiting
+        except AttributeError:
+            # pyserial < 3.0
+            return self._serial.inWaiting()
+
+    def _read_exactly(self, size):
+        """Read exactly ``size`` bytes from the instrument.
+
+        :raises Exception:
+            If the read times out before ``size`` bytes arrive.
+        """
+        self.flush()
+        s = self._serial.read(size)
+        if len(s) < size:
+            raise Exception, 'Serial read timed out'
+        return s
+
+    def read(self, bufsize=4096):
+        """Read up to ``bufsize`` bytes from instrument.  Waits for at least
+        one byte, then returns everything already in the receive buffer
+        instead of reading byte by byte.  Using this low-level function, there
+        is no way to ensure that all the response data has been retrieved, or
+        to make sense of binary data.  It is strongly recommended to use
+        :meth:`.read_ascii`\ , :meth:`.read_binary`\ , or
+        :meth:`.read_ieee754`\ .
+
+        :param int bufsize:
+            Defaults to 4096 bytes.  Maximum size in bytes of the response
+            to return.
+
+        :returns out:
+            Response from the instrument.
+        :rtype: str
+        """
+        self.flush()
+        waiting = self._in_waiting()
+        if waiting:
+            return self._serial.read(min(waiting, bufsize))
+        s = self._read_exactly(1)
+        waiting = min(self._in_waiting(), bufsize - 1)
+        if waiting:
+            s = ''.join([s, self._serial.read(waiting)])
+        return s
 
 
 class I2CMuxInstrument(object):
     """An abstraction layer for the I2C multiplexer chip.
     """
+    #: Priority of this instrument's transactions on the Aardvark.
+    priority = BusScheduler.NORMAL
+
     def __init__(self, aardvark):
         self.__aardvark = aardvark
         self.__address = self.DATA['address']
+        self.__channel = None
+
+    @property
+    def channel(self):
+        """The ``mux_slave_address`` the multiplexer is known to be relaying
+        to, or ``None`` if unknown.
+        """
+        return self.__channel
 
-    def switch_to(self, mux_slave_address):
+    def invalidate(self):
+        """Forget the selected channel so that the next :meth:`.switch_to`
+        always writes to the multiplexer.
+        """
+        self.__channel = None
+
+    def switch_to(self, mux_slave_address, force=False):
         """Setup the multiplexer to relay I2C commands to the device having
-        ``mux_slave_address``
+        ``mux_slave_address``\ .  Nothing is sent if the multiplexer is
+        already relaying to that device.
 
         :param int slave_address:
             The device to which the multiplexer will relay I2C commands.
+        :param bool force:
+            Defaults to ``False``.  If ``True``, write to the multiplexer even
+            if it is already relaying to ``mux_slave_address``\ .
         """
-        self.__aardvark.i2c_write(self.__address, mux_slave_address)
+        with self.__aardvark.transaction(self.priority):
+            if force or self.__channel != mux_slave_address:
+                self.__channel = None
+                self.__aardvark.i2c_write(self.__address, mux_slave_address)
+                self.__channel = mux_slave_address
+
+    @contextmanager
+    def select(self, mux_slave_address, priority=None):
+        """A context manager that switches to ``mux_slave_address`` and holds
+        the multiplexer on that channel until the block exits.  The Aardvark
+        is reserved for the calling thread in the meantime, so the switch and
+        the transactions in the block are atomic.
+
+        :param int mux_slave_address:
+            The device to which the multiplexer will relay I2C commands.
+        :param int priority:
+            Defaults to :attr:`priority`\ .  See :class:`BusScheduler`\ .
+
+        .. code-block:: python
+
+            with chen.select(0x04):
+                aa.i2c_write(0x4A, 0xF3)
+                ret = aa.i2c_read(0x4A, 3)
+        """
+        if priority is None:
+            priority = self.priority
+        with self.__aardvark.transaction(priority):
+            self.switch_to(mux_slave_address)
+            yield self
 
 
 class TempSensorInstrument(object):
@@ -557,75 +2375,356 @@ class TempSensorInstrument(object):
         self.__address = self.DATA['address']
         self.__mux_address = self.DATA['mux_address']
 
-    def read_temp(self):
-        """Read measured temperature data.
+    #: Priority of this instrument's transactions on the Aardvark.
+    priority = BusScheduler.LOW
+
+    #: Command to trigger a temperature measurement without holding the
+    #: I2C bus (no hold master mode).
+    TRIGGER_T = 0xF3
+
+    def read_temp(self, timeout=1.0):
+        """Read measured temperature data.  Equivalent to calling
+        :meth:`.start_measurement` and :meth:`.collect` consecutively.
+
+        :param float timeout:
+            Defaults to 1 second.  See :meth:`.collect`\ .
 
         :returns out:
             Temperature in degress Celsius
         :rtype: float
         """
-        # Configure multiplexer
-        self.__mux.switch_to(self.__mux_address)
+        self.start_measurement()
+        return self.collect(timeout=timeout)
 
-        # Instruct sensor to start measurement
-        BYTECODE = 0xF3
-        self.__aardvark.i2c_write(self.__address, BYTECODE)
+    def start_measurement(self):
+        """Instruct the sensor to start a temperature measurement and return
+        immediately.  The result is retrieved with :meth:`.collect`\ .
+        """
+        with self.__mux.select(self.__mux_address, self.priority):
+            self.__aardvark.i2c_write(self.__address, self.TRIGGER_T)
+
+    def collect(self, timeout=1.0, interval=0.005, max_interval=0.02):
+        """Retrieve the result of the measurement started by
+        :meth:`.start_measurement`\ .  The sensor does not acknowledge its
+        address until the conversion is complete, so it is polled with a
+        short, increasing back-off instead of a fixed delay.
+
+        :param float timeout:
+            Defaults to 1 second.  Maximum time to wait for the conversion.
+        :param float interval:
+            Defaults to 5 ms.  Initial delay between polls.
+        :param float max_interval:
+            Defaults to 20 ms.  The delay between polls doubles until it
+            reaches this value.
 
-        # Wait 2 seconds
-        time.sleep(2)
+        :returns out:
+            Temperature in degress Celsius
+        :rtype: float
+
+        :raises Exception:
+            If the conversion is not complete after ``timeout`` seconds.
+        """
+        return self.collect_sample(timeout, interval, max_interval)[0]
 
-        # Read 3 bytes
+    def collect_sample(self, timeout=1.0, interval=0.005, max_interval=0.02):
+        """Like :meth:`.collect`\ , but also return the status bits and
+        whether the checksum sent by the sensor is correct.
+
+        :returns out:
+            A 3-tuple of the form ``(temperature, status, crc_ok)``\ .
+        :rtype: tuple
+        """
+        NACK = AardvarkInstrument.I2C_STATUS_CODES[3]
         BUFSIZE = 3
-        ret = self.__aardvark.i2c_read(self.__address, BUFSIZE)
+        deadline = time.time() + timeout
+        while True:
+            try:
+                with self.__mux.select(self.__mux_address, self.priority):
+                    ret = self.__aardvark.i2c_read(self.__address, BUFSIZE)
+                break
+            except Exception, e:
+                if e.args != (NACK,):
+                    raise
+            if time.time() + interval > deadline:
+                raise Exception, 'Temperature conversion timed out'
+            time.sleep(interval)
+            interval = min(2 * interval, max_interval)
 
         # Status bits
-        status = bin(ret[1])[-2:]
+        status = ret[1] & 0x03
 
-        # Checksum bits
-        checksum = '{0:02X}'.format(ret[2])
+        # Checksum over the two data bytes
+        crc_ok = self._crc8(ret[:2]) == ret[2]
 
         # Parse data
         data = ((ret[0] << 8) + ((ret[1] >> 2) << 2))
         temp = -46.85 + 175.72 * (float(data) / 2**16)
+        out = (temp, status, crc_ok)
+        return out
+
+    def _crc8(self, data):
+        """Compute the Sensirion CRC-8 (polynomial ``x^8 + x^5 + x^4 + 1``)
+        of ``data``\ .
+        """
+        crc = 0
+        for byte in data:
+            crc ^= byte
+            for bit in range(8):
+                if crc & 0x80:
+                    crc = ((crc << 1) ^ 0x131) & 0xFF
+                else:
+                    crc = (crc << 1) & 0xFF
+        return crc
 
-        # TODO Include timestamp
-        return temp
+
+def read_temps(sensors, timeout=1.0):
+    """Read several :class:`TempSensorInstrument`\ s in one sweep.  All
+    sensors are triggered first, then each one is collected, so the sweep
+    takes about one conversion time instead of one per sensor.
+
+    :param list sensors:
+        The temperature sensors to read.
+    :param float timeout:
+        Defaults to 1 second.  Maximum time to wait for each conversion.
+
+    :returns out:
+        Temperatures in degrees Celsius, in the same order as ``sensors``\ .
+    :rtype: list
+
+    .. code-block:: python
+
+        import microlab_instruments as mi
+
+        aa = mi.Aardvark()
+        chen = mi.Chen(aa)
+        traxex = mi.Traxex(aa, chen)
+        xin = mi.Xin(aa, chen)
+        print mi.read_temps([traxex, xin])
+    """
+    for sensor in sensors:
+        sensor.start_measurement()
+    out = [sensor.collect(timeout=timeout) for sensor in sensors]
+    return out
 
 
 class FPGAInstrument(object):
     """An abstraction layer for the FPGA.
     """
-    def __init__(self, aardvark):
+    #: Priority of this instrument's transactions on the Aardvark.
+    priority = BusScheduler.HIGH
+
+    def __init__(self, aardvark, shadow=False):
+        """Initialize the FPGA.
+
+        :param Aardvark aardvark:
+            An Aardvark object through which I2C commands are relayed.
+        :param bool shadow:
+            Defaults to ``False``.  If ``True``, the last known value of each
+            register is kept in a shadow cache.  Redundant writes are skipped
+            and reads of registers not listed in ``DATA['volatile_registers']``
+            are served from the cache.
+        """
         self.__aardvark = aardvark
         self.__address = self.DATA['address']
+        self.__volatile = frozenset(self.DATA.get('volatile_registers', ()))
+        self.shadow = shadow
+        self.__shadow = {}
 
-    def __write_command(self, register):
-        self.__aardvark.i2c_write(self.__address, register)
-
-    def __write_payload(self, payload):
-        self.__aardvark.i2c_write(self.__address, payload)
+    def invalidate(self, register=None):
+        """Forget the shadow value of ``register``\ , or of all registers.
 
-    def __read(self):
-        bufsize = 1
-        return self.__aardvark.i2c_read(self.__address, bufsize)
+        :param int register:
+            Defaults to ``None``, which clears the whole shadow cache.
+        """
+        if register is None:
+            self.__shadow.clear()
+        else:
+            self.__shadow.pop(register, None)
 
     def write(self, register, payload):
-        """Write a 1-byte-long ``payload`` to a ``register`` address.
+        """Write a 1-byte-long ``payload`` to a ``register`` address.  The
+        register address and the payload are sent in one I2C transaction.
 
         :param int payload:
             The data to write.  Limited to 1 byte long.
         :param int register:
             The register address to write to.  Limited to 1 byte long.
         """
-        self.__write_command(register)
-        self.__write_payload(payload)
+        self.write_burst(register, [payload])
 
     def read(self, register):
-        """Read the contents of ``register``.
+        """Read the contents of ``register``.  The register address is written
+        and the contents are read back using a repeated start.
 
         :param int register:
             The register address to read.  Limited to 1 byte long.
         """
-        self.__write_command(register)
-        return self.__read()
+        return self.read_burst(register, 1)
+
+    def write_burst(self, register, payload):
+        """Write a ``register`` address followed by several bytes of
+        ``payload`` in one I2C transaction.  The FPGA auto-increments the
+        register address after each payload byte.
+
+        :param int register:
+            The first register address to write to.  Limited to 1 byte long.
+        :param list payload:
+            The data to write.  Each element is limited to 1 byte long.
+
+        :returns out:
+            Number of bytes sent, including the register address.
+        :rtype: int
+        """
+        registers = range(register, register + len(payload))
+        with self.__aardvark.transaction(self.priority):
+            if self.shadow:
+                cached = [self.__shadow.get(r) for r in registers]
+                if cached == list(payload) and \
+                        self.__volatile.isdisjoint(registers):
+                    return 0
+            bytecodes = [register]
+            bytecodes.extend(payload)
+            out = self.__aardvark.i2c_write_block(self.__address, bytecodes)
+            if self.shadow:
+                self.__shadow.update(zip(registers, payload))
+            return out
+
+    def read_burst(self, register, bufsize):
+        """Read ``bufsize`` bytes starting at ``register`` in one I2C
+        transaction, using a repeated start between the register address and
+        the read.
+
+        :param int register:
+            The first register address to read.  Limited to 1 byte long.
+        :param int bufsize:
+            Number of bytes to read.
+
+        :returns out:
+            A ``bufsize``\ -length *list* of *int*\ s.
+        :rtype: list
+        """
+        registers = range(register, register + bufsize)
+        with self.__aardvark.transaction(self.priority):
+            if self.shadow and self.__volatile.isdisjoint(registers):
+                cached = [self.__shadow.get(r) for r in registers]
+                if None not in cached:
+                    return array('B', cached)
+            out = self.__aardvark.i2c_write_read(self.__address, register, bufsize)
+            if self.shadow:
+                self.__shadow.update(zip(registers, out))
+            return out
+
+    def read_modify_write(self, register, mask, value):
+        """Atomically replace the bits of ``register`` selected by ``mask``
+        with the corresponding bits of ``value``\ .  The other bits are left
+        unchanged.
+
+        :param int register:
+            The register address to modify.  Limited to 1 byte long.
+        :param int mask:
+            The bits to be replaced.
+        :param int value:
+            The new value of the masked bits, already aligned with ``mask``\ .
+
+        :returns out:
+            The new contents of ``register``\ .
+        :rtype: int
+        """
+        with self.__aardvark.transaction(self.priority):
+            old = self.read(register)[0]
+            out = (old & ~mask & 0xFF) | (value & mask)
+            if out != old:
+                self.write(register, out)
+            return out
+
+    def write_field(self, register, mask, value):
+        """Write ``value`` into the bitfield of ``register`` selected by
+        ``mask``\ .  ``value`` is shifted to the position of the lowest set bit
+        of ``mask``\ .
+
+        .. code-block:: python
+
+            # Set bits 5:4 of register 0x11 to 0b10
+            kerrigan.write_field(0x11, 0x30, 0b10)
+        """
+        shift = self._mask_shift(mask)
+        return self.read_modify_write(register, mask, value << shift)
+
+    def read_field(self, register, mask):
+        """Read the bitfield of ``register`` selected by ``mask``\ , shifted
+        down to bit 0.
+
+        :rtype: int
+        """
+        shift = self._mask_shift(mask)
+        return (self.read(register)[0] & mask) >> shift
+
+    def set_bits(self, register, mask):
+        """Atomically set the bits of ``register`` selected by ``mask``\ .
+        """
+        return self.read_modify_write(register, mask, 0xFF)
+
+    def clear_bits(self, register, mask):
+        """Atomically clear the bits of ``register`` selected by ``mask``\ .
+        """
+        return self.read_modify_write(register, mask, 0x00)
+
+    def _mask_shift(self, mask):
+        """Returns the position of the lowest set bit of ``mask``\ .
+        """
+        if mask == 0:
+            raise Exception, 'mask must have at least one bit set'
+        return (mask & -mask).bit_length() - 1
+
+    def write_block(self, registers):
+        """Write several registers.  Contiguous register addresses are merged
+        so that each run is written with one :meth:`.write_burst`\ .
 
+        :param dict registers:
+            A mapping of register addresses to 1-byte-long payloads.
+        """
+        for first, payload in self._contiguous_runs(registers):
+            self.write_burst(first, payload)
+
+    def read_block(self, first_register, last_register):
+        """Read the contiguous range of registers from ``first_register`` to
+        ``last_register``\ , inclusive, with one :meth:`.read_burst`\ .
+
+        :param int first_register:
+            The first register address to read.
+        :param int last_register:
+            The last register address to read.
+
+        :returns out:
+            A mapping of register addresses to their contents.
+        :rtype: dict
+
+        .. code-block:: python
+
+            import microlab_instruments as mi
+
+            aa = mi.Aardvark()
+            kerrigan = mi.Kerrigan(aa)
+            register_map = kerrigan.read_block(0x00, 0xFF)
+        """
+        bufsize = last_register - first_register + 1
+        ret = self.read_burst(first_register, bufsize)
+        out = dict(zip(range(first_register, last_register + 1), ret))
+        return out
+
+    def _contiguous_runs(self, registers):
+        """A generator that, given a mapping of register addresses to payloads,
+        yields ``(first_register, payload_list)`` for each run of contiguous
+        register addresses.
+        """
+        run = []
+        first = None
+        for register in sorted(registers):
+            if run and register != first + len(run):
+                yield first, run
+                run = []
+            if not run:
+                first = register
+            run.append(registers[register])
+        if run:
+            yield first, run
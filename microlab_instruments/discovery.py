@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+.. module:: discovery
+   :synopsis: Finds TCP/IP instruments on the network and records their
+              socket pairs in a registry file.
+
+The registry is a JSON file mapping nicknames to socket pairs, followed by
+the serial number reported by ``*IDN?``\ ::
+
+    {"darkrai": ["192.168.1.5", 5025, "MY12345678"],
+     "zygarde": ["192.168.1.6", 5025, "MY23456789"]}
+
+It is read from ``$MICROLAB_REGISTRY``\ , or ``~/.microlab_instruments.json``
+if that is not set.  Instrument classes use the socket pairs in the registry
+instead of the defaults in their ``DATA`` dicts.
+
+To probe the bench and write the registry::
+
+    python -m microlab_instruments.discovery 192.168.1.0/24
+"""
+
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+DEFAULT_REGISTRY = os.path.join(os.path.expanduser('~'), '.microlab_instruments.json')
+
+
+def registry_path():
+    """Returns the path of the registry file.
+    """
+    return os.environ.get('MICROLAB_REGISTRY', DEFAULT_REGISTRY)
+
+
+def load_registry(path=None):
+    """Read the registry file.
+
+    :param str path:
+        Defaults to :func:`registry_path`\ .
+
+    :returns out:
+        A mapping of nicknames to ``(host, port, serial)`` tuples.
+        ``serial`` is ``None`` in entries written without one.  Empty if the
+        file does not exist or cannot be parsed.
+    :rtype: dict
+    """
+    if path is None:
+        path = registry_path()
+    try:
+        fd = open(path, 'r')
+        try:
+            raw = json.load(fd)
+        finally:
+            fd.close()
+    except (IOError, ValueError):
+        return {}
+    out = {}
+    for nickname, entry in raw.items():
+        serial = str(entry[2]) if len(entry) > 2 and entry[2] else None
+        out[nickname] = (str(entry[0]), int(entry[1]), serial)
+    return out
+
+
+def save_registry(registry, path=None):
+    """Write ``registry`` to the registry file.
+
+    :param dict registry:
+        A mapping of nicknames to ``(host, port, serial)`` tuples.
+    :param str path:
+        Defaults to :func:`registry_path`\ .
+    """
+    if path is None:
+        path = registry_path()
+    fd = open(path, 'w')
+    try:
+        json.dump(registry, fd, indent=4, sort_keys=True)
+    finally:
+        fd.close()
+
+
+def expand_hosts(spec):
+    """Expand an address range into a list of IPv4 addresses.
+
+    :param str spec:
+        Either a CIDR block such as ``'192.168.1.0/24'``\ , a range of the last
+        octet such as ``'192.168.1.2-12'``\ , or a single address.
+
+    :rtype: list
+    """
+    if '/' in spec:
+        base, bits = spec.split('/')
+        bits = int(bits)
+        network = struct.unpack('>I', socket.inet_aton(base))[0]
+        mask = (0xFFFFFFFF << (32 - bits)) & 0xFFFFFFFF
+        first = network & mask
+        count = 1 << (32 - bits)
+        if count > 2:
+            # Skip the network and broadcast addresses
+            numbers = range(first + 1, first + count - 1)
+        else:
+            numbers = range(first, first + count)
+        out = [socket.inet_ntoa(struct.pack('>I', n)) for n in numbers]
+        return out
+    head, last = spec.rsplit('.', 1)
+    if '-' in last:
+        lo, hi = map(int, last.split('-'))
+        out = ['{0}.{1}'.format(head, n) for n in range(lo, hi + 1)]
+        return out
+    return [spec]
+
+
+def probe(host, port=5025, timeout=0.25):
+    """Connect to ``host`` and ask for its identification string.
+
+    :param str host:
+        An IPv4 address.
+    :param int port:
+        Defaults to 5025, the SCPI socket port.
+    :param float timeout:
+        Defaults to 0.25 seconds.  Applies to the connection and to the
+        response separately.
+
+    :returns out:
+        The response to ``*IDN?`` without the newline, or ``None`` if nothing
+        answered.
+    :rtype: str
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect((host, port))
+        sock.sendall('*IDN?\n')
+        stream = []
+        while True:
+            s = sock.recv(4096)
+            if not s:
+                break
+            stream.append(s)
+            if '\n' in s:
+                break
+        out = ''.join(stream).strip()
+        return out or None
+    except (socket.error, socket.timeout):
+        return None
+    finally:
+        sock.close()
+
+
+def discover(hosts, port=5025, timeout=0.25, max_threads=256):
+    """Probe ``hosts`` concurrently.
+
+    :param list hosts:
+        IPv4 addresses to probe.  See :func:`expand_hosts`\ .
+    :param int port:
+        Defaults to 5025.
+    :param float timeout:
+        Defaults to 0.25 seconds.  See :func:`probe`\ .
+    :param int max_threads:
+        Defaults to 256.  Maximum number of probes in flight at once.
+
+    :returns out:
+        A mapping of the addresses that answered to their identification
+        strings.
+    :rtype: dict
+    """
+    out = {}
+    lock = threading.Lock()
+    slots = threading.BoundedSemaphore(max_threads)
+
+    def worker(host):
+        try:
+            idn = probe(host, port, timeout)
+            if idn is not None:
+                with lock:
+                    out[host] = idn
+        finally:
+            slots.release()
+
+    threads = []
+    for host in hosts:
+        slots.acquire()
+        t = threading.Thread(target=worker, args=(host,))
+        t.daemon = True
+        t.start()
+        threads.append(t)
+    for t in threads:
+        t.join()
+    return out
+
+
+def _idn_fields(idn):
+    """Returns the model and serial number of an identification string.
+    """
+    fields = [f.strip() for f in idn.split(',')]
+    model = fields[1] if len(fields) > 1 else idn
+    serial = fields[2] if len(fields) > 2 and fields[2] not in ('', '0') else None
+    out = (model, serial)
+    return out
+
+
+def match(found, known, port=5025):
+    """Match identification strings to known instruments by model number.
+
+    When several instruments share a model number, they are told apart by
+    serial number (``DATA['serial']``\ , which is filled in from the
+    registry), then by their default address.  An instrument still left
+    over is matched if it is the only one of its model not matched yet.
+    Otherwise it is left out of the registry.
+
+    :param dict found:
+        A mapping of addresses to identification strings, as returned by
+        :func:`discover`\ .
+    :param list known:
+        ``DATA`` dicts of the TCP/IP instruments.
+    :param int port:
+        Defaults to 5025.
+
+    :returns out:
+        A 2-tuple of the registry (nicknames to ``(host, port, serial)``
+        tuples) and a list of ``(address, idn)`` pairs that could not be
+        matched.
+    :rtype: tuple
+    """
+    registry = {}
+    ambiguous = []
+    for host, idn in sorted(found.items()):
+        model, serial = _idn_fields(idn)
+        candidates = [d for d in known if model and model in d['name'].split()]
+        # A known serial number rules out every other unit
+        candidates = [d for d in candidates
+                      if not (serial and d.get('serial') and d['serial'] != serial)]
+        if len(candidates) > 1 and serial:
+            by_serial = [d for d in candidates if d.get('serial') == serial]
+            candidates = by_serial or candidates
+        if len(candidates) > 1:
+            by_host = [d for d in candidates if d['socket'][0] == host]
+            candidates = by_host or candidates
+        if len(candidates) == 1:
+            registry[candidates[0]['nickname']] = (host, port, serial)
+        else:
+            ambiguous.append((host, idn, candidates))
+
+    unmatched = []
+    for host, idn, candidates in ambiguous:
+        left = [d for d in candidates if d['nickname'] not in registry]
+        if len(left) == 1:
+            registry[left[0]['nickname']] = (host, port, _idn_fields(idn)[1])
+        else:
+            unmatched.append((host, idn))
+    out = (registry, unmatched)
+    return out
+
+
+def main(argv=None):
+    """Probe the address ranges given on the command line, print what was
+    found, and write the registry file.
+    """
+    import microlab_instruments as mi
+
+    if argv is None:
+        argv = sys.argv[1:]
+    if not argv:
+        print 'usage: python -m microlab_instruments.discovery RANGE [RANGE ...]'
+        return 2
+    hosts = []
+    for spec in argv:
+        hosts.extend(expand_hosts(spec))
+    start = time.time()
+    found = discover(hosts)
+    registry, unmatched = match(found, mi.TCPIP_INSTRUMENTS)
+    for nickname, (host, port, serial) in sorted(registry.items()):
+        print '{0:<10} {1}:{2}  {3}'.format(nickname, host, port, found[host])
+    for host, idn in unmatched:
+        print '{0:<10} {1}  {2}'.format('?', host, idn)
+    print 'Probed {0} addresses in {1:.2f} s'.format(len(hosts), time.time() - start)
+    save_registry(registry)
+    print 'Wrote', registry_path()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,6 +2,8 @@
 # -*- coding: utf-8 -*-
 
 import base_classes as bc
+import discovery
+from array import array
 from struct import pack, unpack
 
 # FPGA Instruments
@@ -9,6 +11,9 @@ KERRIGAN = {
     'nickname'          : 'kerrigan',
     'name'              : 'Xilinx Virtex 5',
     'address'           : 0x55,
+    # Registers whose contents may change without being written, and which
+    # must never be served from the shadow cache.
+    'volatile_registers': (),
     }
 
 # I2C Instruments
@@ -36,6 +41,8 @@ ARCEUS   = {
     'name'              : 'Agilent 8753ES S-Parameter Network Analyzer',
     'get_byte_order'    : '',
     'byte_order_little' : '',
+    # FORM3 is 64-bit IEEE-754, big-endian
+    'init_commands'     : ('FORM3',),
     }
 MELOETTA = {
     'nickname'          : 'meloetta',
@@ -55,8 +62,14 @@ DARKRAI  = {
     'nickname'          : 'darkrai',
     'name'              : 'Agilent N9020A MXA Signal Analyzer',
     'socket'            : ('192.168.1.5', 5025),
-    'get_byte_order'    : '',
-    'byte_order_little' : '',
+    'get_byte_order'    : ':format:border?',
+    'byte_order_little' : 'SWAP',
+    'get_data_format'   : ':format:data?',
+    'data_format_single': 'REAL,32',
+    'data_format_double': 'REAL,64',
+    'init_commands'     : (':format:data real,32',
+                           ':format:border swap',
+                           '*OPC'),
     }
 DEOXYS   = {
     'nickname'          : 'deoxys',
@@ -64,26 +77,39 @@ DEOXYS   = {
     'socket'            : ('192.168.1.10', 5025),
     'get_byte_order'    : ':waveform:byteorder?',
     'byte_order_little' : 'LSBF',
+    'init_commands'     : (':waveform:byteorder msbfirst',
+                           ':waveform:format word',
+                           '*OPC'),
     }
 GENESECT = {
     'nickname'          : 'genesect',
     'name'              : 'Agilent B2962A Power Source',
+    # Serial number from *IDN?, which tells the two B2962As apart during
+    # discovery.  Recorded in the registry once found.
+    'serial'            : None,
     'socket'            : ('192.168.1.9', 5025),
     'get_byte_order'    : ':format:border?',
-    'byte_order_little' : 'NORM',
+    'byte_order_little' : 'SWAP',
     'get_data_format'   : ':format:data?',
     'data_format_single': 'REAL,32',
     'data_format_double': 'REAL,64',
+    'init_commands'     : (':format:data real,32',
+                           '*OPC'),
     }
 GIRATINA = {
     'nickname'          : 'giratina',
     'name'              : 'Agilent B2962A Power Source',
+    # Serial number from *IDN?, which tells the two B2962As apart during
+    # discovery.  Recorded in the registry once found.
+    'serial'            : None,
     'socket'            : ('192.168.1.8', 5025),
     'get_byte_order'    : ':format:border?',
-    'byte_order_little' : 'NORM',
+    'byte_order_little' : 'SWAP',
     'get_data_format'   : ':format:data?',
     'data_format_single': 'REAL,32',
     'data_format_double': 'REAL,64',
+    'init_commands'     : (':format:data real,32',
+                           '*OPC'),
     }
 HEATRAN  = {
     'nickname'          : 'heatran',
@@ -91,6 +117,11 @@ HEATRAN  = {
     'socket'            : ('192.168.1.11', 5025),
     'get_byte_order'    : '',
     'byte_order_little' : '',
+    # Binary data export of the first analyzer module, one little-endian
+    # 8-byte word per sample.  Takes the first sample and optionally the
+    # sample after the last one.
+    'capture_query'     : ':module1:data:export?',
+    'sample_bytes'      : 8,
     }
 HO_OH    = {
     'nickname'          : 'ho_oh',
@@ -110,33 +141,73 @@ RAYQUAZA = {
     'nickname'          : 'rayquaza',
     'name'              : 'Agilent E4443A PSA Series Spectrum Analyzer',
     'socket'            : ('192.168.1.2', 5025),
-    'get_byte_order'    : '',
-    'byte_order_little' : '',
+    'get_byte_order'    : ':format:border?',
+    'byte_order_little' : 'SWAP',
+    'get_data_format'   : ':format:data?',
+    'data_format_single': 'REAL,32',
+    'data_format_double': 'REAL,64',
+    'init_commands'     : (':format:data real,32',
+                           ':format:border swap',
+                           '*OPC'),
     }
 YVELTAL  = {
     'nickname'          : 'yveltal',
     'name'              : 'Agilent B2902A Precision Source/Measure Unit',
     'socket'            : ('192.168.1.7', 5025),
     'get_byte_order'    : ':format:border?',
-    'byte_order_little' : 'NORM',
+    'byte_order_little' : 'SWAP',
     'get_data_format'   : ':format:data?',
     'data_format_single': 'REAL,32',
     'data_format_double': 'REAL,64',
+    'init_commands'     : (':format:data real,32',
+                           '*OPC'),
     }
 ZYGARDE  = {
     'nickname'          : 'zygarde',
     'name'              : 'Agilent E5071C ENA Series Network Analyzer',
     'socket'            : ('192.168.1.6', 5025),
-    'get_byte_order'    : '',
-    'byte_order_little' : '',
+    'get_byte_order'    : ':format:border?',
+    'byte_order_little' : 'SWAP',
+    'get_data_format'   : ':format:data?',
+    'data_format_single': 'REAL32',
+    'data_format_double': 'REAL',
+    'init_commands'     : (':format:data real',
+                           ':format:border swap',
+                           '*OPC'),
+    'compound_blocks'   : True,
     }
 
+TCPIP_INSTRUMENTS = (
+    DARKRAI,
+    DEOXYS,
+    GENESECT,
+    GIRATINA,
+    HEATRAN,
+    HO_OH,
+    KYUREM,
+    RAYQUAZA,
+    YVELTAL,
+    ZYGARDE,
+    )
+
+# Socket pairs found by ``python -m microlab_instruments.discovery`` take
+# precedence over the defaults above.
+REGISTRY = discovery.load_registry()
+for d in TCPIP_INSTRUMENTS:
+    if d['nickname'] in REGISTRY:
+        host, port, serial = REGISTRY[d['nickname']]
+        d['socket'] = (host, port)
+        if serial:
+            d['serial'] = serial
+
 class Kerrigan(bc.FPGAInstrument):
-    def __init__(self, aardvark):
+    def __init__(self, aardvark, shadow=False):
         """Initialize the FPGA.
 
         :param Aardvark aardvark:
                 An Aardvark object through which I2C commands are relayed.
+        :param bool shadow:
+                Defaults to ``False``.  Enables the shadow register cache.
 
         .. code-block:: python
 
@@ -146,7 +217,7 @@ class Kerrigan(bc.FPGAInstrument):
             kerrigan = mi.Kerrigan(aa)
         """
         self.DATA = KERRIGAN
-        super(Kerrigan, self).__init__(aardvark=aardvark)
+        super(Kerrigan, self).__init__(aardvark=aardvark, shadow=shadow)
 
 
 class Chen(bc.I2CMuxInstrument):
@@ -205,37 +276,64 @@ class Xin(bc.TempSensorInstrument):
         super(Xin, self).__init__(aardvark=aardvark, mux=mux)
 
 
-class Arceus(bc.GPIBInstrument):
-    def __init__(self):
+class Arceus(bc.NetworkAnalyzerInstrument, bc.GPIBInstrument):
+    def __init__(self, reset=True):
         self.DATA = ARCEUS
-        super(Arceus, self).__init__(nickname=self.DATA['nickname'])
+        super(Arceus, self).__init__(nickname=self.DATA['nickname'], reset=reset)
+
+    def _fetch_stimulus(self):
+        """The 8753ES has no stimulus data query, so the linear frequency
+        axis is computed from the start and stop frequencies.
+        """
+        start = float(self.ask_ascii('STAR?'))
+        stop = float(self.ask_ascii('STOP?'))
+        points = int(float(self.ask_ascii('POIN?')))
+        step = (stop - start) / (points - 1) if points > 1 else 0.0
+        out = array('d', [start + n * step for n in xrange(points)])
+        if bc.np is not None:
+            out = bc.np.array(out)
+        return out
+
+    def _prepare_traces(self, count):
+        pass
+
+    def _sparameter_query(self, index, sparam):
+        return '{0};OUTPDATA'.format(sparam)
+
+    def _read_block(self):
+        """Read a FORM3 block.  Its header is ``#A`` followed by the size of
+        the payload as a 16-bit big-endian integer.
+        """
+        header = self._read_exactly(4)
+        if header[:2] != '#A':
+            raise Exception, 'Expected a FORM3 block'
+        size = unpack('>H', header[2:])[0]
+        out = self._read_exactly(size)
+        return out
 
 
 class Meloetta(bc.GPIBInstrument):
-    def __init__(self):
+    def __init__(self, reset=True):
         self.DATA = MELOETTA
-        super(Meloetta, self).__init__(nickname=self.DATA['nickname'])
+        super(Meloetta, self).__init__(nickname=self.DATA['nickname'], reset=reset)
 
 
 class Xerneas(bc.GPIBInstrument):
-    def __init__(self):
+    def __init__(self, reset=True):
         self.DATA = XERNEAS
-        super(Xerneas, self).__init__(nickname=self.DATA['nickname'])
+        super(Xerneas, self).__init__(nickname=self.DATA['nickname'], reset=reset)
 
 
-class Darkrai(bc.TCPIPInstrument):
-    def __init__(self):
+class Darkrai(bc.SpectrumAnalyzerInstrument):
+    def __init__(self, reset=True):
         self.DATA = DARKRAI
-        super(Darkrai, self).__init__(socket_pair=self.DATA['socket'])
+        super(Darkrai, self).__init__(socket_pair=self.DATA['socket'], reset=reset)
 
 
 class Deoxys(bc.TCPIPInstrument):
-    def __init__(self):
+    def __init__(self, reset=True):
         self.DATA = DEOXYS
-        super(Deoxys, self).__init__(socket_pair=self.DATA['socket'])
-        self.write(':waveform:byteorder msbfirst')
-        self.write(':waveform:format word')
-        self.write('*OPC')
+        super(Deoxys, self).__init__(socket_pair=self.DATA['socket'], reset=reset)
 
     def _chop16(self, s):
         """A generator that, given a string, yields its 16-bit slices.
@@ -254,12 +352,15 @@ class Deoxys(bc.TCPIPInstrument):
             yield k
             n += 2
 
-    def _half_to_float(self, half):
+    def _half_to_float(self, half, byte_order=None):
         """Converts half-precision floating-point (16-bit) binary data to
         Python ``float``\ .
 
         :param str half:
             A 16-bit string to be converted to a Python float
+        :param str byte_order:
+            Defaults to ``None``\ , which asks the instrument.  ``'<'`` or
+            ``'>'``\ , so that a block of data is converted with one query.
         :returns out:
             The actual floating point number represented by the 16-bit string.
         :rtype: float
@@ -269,7 +370,9 @@ class Deoxys(bc.TCPIPInstrument):
         .. _fpmurphy: http://fpmurphy.blogspot.com/2008/12/half-precision-floating-point-format_14.html
         """
         # Get byte order of input
-        bo = '<' if self._is_little_endian() else '>'
+        bo = byte_order
+        if bo is None:
+            bo = '<' if self._is_little_endian() else '>'
 
         # Preliminary unpacking
         fmt = '{0}H'.format(bo)
@@ -279,27 +382,24 @@ class Deoxys(bc.TCPIPInstrument):
         s = int((h >> 15) & 0x00000001)  # sign
         e = int((h >> 10) & 0x0000001F)  # exponent
         f = int(h         & 0x000003FF)  # fraction
-        if e == 0x00:   # exponent is 0
-            if f == 0x00:
-                hpad = int(s << 31)
-            else:
+        if e == 0x00 and f == 0x00:     # signed zero
+            hpad = int(s << 31)
+        elif e == 0x1F:                 # exponent is 31: infinity or NaN
+            hpad = int((s << 31) | 0x7F800000 | (f << 13))
+        else:
+            if e == 0x00:               # subnormal, so normalize it
                 while not (f & 0x00000400):
                     f <<= 1
                     e -= 1
                 e += 1
                 f &= ~0x00000400
-        elif e == 0x1F: # exponent is 31
-            if f == 0x00:
-                hpad = int((s << 31) | 0x7F800000)
-            else:
-                hpad = int((s << 31) | 0x7F800000 | (f << 13))
-        e = e + (127 - 15)
-        f = f << 13
-        hpad = int((s << 31) | (e << 23) | f)
+            e = e + (127 - 15)
+            f = f << 13
+            hpad = int((s << 31) | (e << 23) | f)
 
         # struct.pack hack
         st = pack('I', hpad)
-        out = unpack('f', st)
+        out = unpack('f', st)[0]
         return out
 
     def read_preamble(self):
@@ -366,57 +466,51 @@ class Deoxys(bc.TCPIPInstrument):
         return out
 
 
-class Genesect(bc.TCPIPInstrument):
-    def __init__(self):
+class Genesect(bc.SourceMeasureInstrument):
+    def __init__(self, reset=True):
         self.DATA = GENESECT
-        super(Genesect, self).__init__(socket_pair=self.DATA['socket'])
-        self.write(':format:data real,32')
-        self.write('*OPC')
+        super(Genesect, self).__init__(socket_pair=self.DATA['socket'], reset=reset)
 
 
-class Giratina(bc.TCPIPInstrument):
-    def __init__(self):
+class Giratina(bc.SourceMeasureInstrument):
+    def __init__(self, reset=True):
         self.DATA = GIRATINA
-        super(Giratina, self).__init__(socket_pair=self.DATA['socket'])
-        self.write(':format:data real,32')
-        self.write('*OPC')
+        super(Giratina, self).__init__(socket_pair=self.DATA['socket'], reset=reset)
 
 
-class Heatran(bc.TCPIPInstrument):
-    def __init__(self):
+class Heatran(bc.LogicAnalyzerInstrument):
+    def __init__(self, reset=True):
         self.DATA = HEATRAN
-        super(Heatran, self).__init__(socket_pair=self.DATA['socket'])
+        super(Heatran, self).__init__(socket_pair=self.DATA['socket'], reset=reset)
 
 
-class Ho_oh(bc.TCPIPInstrument):
-    def __init__(self):
+class Ho_oh(bc.SignalGeneratorInstrument):
+    def __init__(self, reset=True):
         self.DATA = HO_OH
-        super(Ho_oh, self).__init__(socket_pair=self.DATA['socket'])
+        super(Ho_oh, self).__init__(socket_pair=self.DATA['socket'], reset=reset)
 
 
-class Kyurem(bc.TCPIPInstrument):
-    def __init__(self):
+class Kyurem(bc.SignalGeneratorInstrument):
+    def __init__(self, reset=True):
         self.DATA = KYUREM
-        super(Kyurem, self).__init__(socket_pair=self.DATA['socket'])
+        super(Kyurem, self).__init__(socket_pair=self.DATA['socket'], reset=reset)
 
 
-class Rayquaza(bc.TCPIPInstrument):
-    def __init__(self):
+class Rayquaza(bc.SpectrumAnalyzerInstrument):
+    def __init__(self, reset=True):
         self.DATA = RAYQUAZA
-        super(Rayquaza, self).__init__(socket_pair=self.DATA['socket'])
+        super(Rayquaza, self).__init__(socket_pair=self.DATA['socket'], reset=reset)
 
 
-class Yveltal(bc.TCPIPInstrument):
-    def __init__(self):
+class Yveltal(bc.SourceMeasureInstrument):
+    def __init__(self, reset=True):
         self.DATA = YVELTAL
-        super(Yveltal, self).__init__(socket_pair=self.DATA['socket'])
-        self.write(':format:data real,32')
-        self.write('*OPC')
+        super(Yveltal, self).__init__(socket_pair=self.DATA['socket'], reset=reset)
 
 
-class Zygarde(bc.TCPIPInstrument):
-    def __init__(self):
+class Zygarde(bc.NetworkAnalyzerInstrument, bc.TCPIPInstrument):
+    def __init__(self, reset=True):
         self.DATA = ZYGARDE
-        super(Zygarde, self).__init__(socket_pair=self.DATA['socket'])
+        super(Zygarde, self).__init__(socket_pair=self.DATA['socket'], reset=reset)
 
 
@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+.. module:: pipeline
+   :synopsis: Decouples instrument acquisition from analysis with a
+              shared-memory ring buffer and worker processes.
+"""
+
+import ctypes
+import multiprocessing
+import threading
+from Queue import Empty
+
+
+class SharedRingBuffer(object):
+    """A ring buffer of fixed-size slots in shared memory.  Raw blocks written
+    by one producer are read, in order, by any number of consumer processes.
+
+    The producer never waits: if every slot is still full, the block is
+    dropped and counted in :attr:`dropped`\ .
+    """
+    def __init__(self, slots=64, slot_size=1 << 20):
+        """
+        :param int slots:
+            Defaults to 64.  Number of blocks the buffer can hold.
+        :param int slot_size:
+            Defaults to 1 MiB.  Maximum size in bytes of one block.
+        """
+        self.slots = slots
+        self.slot_size = slot_size
+        self.__data = multiprocessing.RawArray(ctypes.c_char, slots * slot_size)
+        self.__length = multiprocessing.RawArray(ctypes.c_long, slots)
+        self.__sequence = multiprocessing.RawArray(ctypes.c_ulong, slots)
+        self.__free = multiprocessing.Semaphore(slots)
+        self.__filled = multiprocessing.Semaphore(0)
+        self.__read_lock = multiprocessing.Lock()
+        self.__read_index = multiprocessing.RawValue(ctypes.c_ulong, 0)
+        self.__write_index = 0
+        self.__written = multiprocessing.RawValue(ctypes.c_ulong, 0)
+        self.__dropped = multiprocessing.RawValue(ctypes.c_ulong, 0)
+        self.__oversize = multiprocessing.RawValue(ctypes.c_ulong, 0)
+
+    @property
+    def written(self):
+        """Number of blocks written to the buffer.
+        """
+        return self.__written.value
+
+    @property
+    def dropped(self):
+        """Number of blocks dropped because the buffer was full (overruns).
+        """
+        return self.__dropped.value
+
+    @property
+    def oversize(self):
+        """Number of blocks dropped because they were larger than a slot.
+        """
+        return self.__oversize.value
+
+    def put(self, block, sequence=0, block_until_free=False):
+        """Copy ``block`` into the next free slot.
+
+        :param str block:
+            Raw data, at most :attr:`slot_size` bytes long.
+        :param int sequence:
+            Defaults to 0.  A number returned with the block by :meth:`.get`\ .
+        :param bool block_until_free:
+            Defaults to ``False``.  If ``True``, wait for a free slot (back-
+            pressure) instead of dropping ``block``\ .
+
+        :returns out:
+            ``True`` if the block was written, ``False`` if it was dropped.
+        :rtype: bool
+        """
+        if len(block) > self.slot_size:
+            self.__oversize.value += 1
+            return False
+        if not self.__free.acquire(block_until_free):
+            self.__dropped.value += 1
+            return False
+        self.__write(block, sequence, len(block))
+        return True
+
+    def close(self, consumers, timeout=None):
+        """Wake up ``consumers`` readers with an end-of-stream marker each.
+        Waits for free slots if necessary.
+
+        :param float timeout:
+            Defaults to ``None``, which waits indefinitely.  Seconds to wait
+            for each free slot before giving up.
+
+        :returns out:
+            Number of end-of-stream markers written.
+        :rtype: int
+        """
+        out = 0
+        for n in range(consumers):
+            if timeout is None:
+                self.__free.acquire()
+            elif not self.__free.acquire(True, timeout):
+                break
+            self.__write('', 0, -1)
+            out += 1
+        return out
+
+    def __write(self, block, sequence, length):
+        i = self.__write_index % self.slots
+        if length > 0:
+            ctypes.memmove(ctypes.addressof(self.__data) + i * self.slot_size,
+                           block, length)
+        self.__length[i] = length
+        self.__sequence[i] = sequence
+        self.__write_index += 1
+        if length >= 0:
+            self.__written.value += 1
+        self.__filled.release()
+
+    def get(self, timeout=None):
+        """Copy the oldest block out of the buffer.
+
+        :param float timeout:
+            Defaults to ``None``, which waits indefinitely.
+
+        :returns out:
+            A 2-tuple of the form ``(sequence, block)``\ .  ``block`` is
+            ``None`` at the end of the stream.
+        :rtype: tuple
+
+        :raises Queue.Empty:
+            If no block arrives within ``timeout`` seconds.
+        """
+        if timeout is None:
+            self.__filled.acquire()
+        elif not self.__filled.acquire(True, timeout):
+            raise Empty
+        with self.__read_lock:
+            i = self.__read_index.value % self.slots
+            length = self.__length[i]
+            sequence = self.__sequence[i]
+            if length < 0:
+                block = None
+            else:
+                block = ctypes.string_at(
+                    ctypes.addressof(self.__data) + i * self.slot_size, length)
+            self.__read_index.value += 1
+        self.__free.release()
+        out = (sequence, block)
+        return out
+
+
+class AcquisitionPipeline(object):
+    """Runs acquisition on a thread of the calling process and analysis in
+    worker processes.  Raw blocks pass through a :class:`SharedRingBuffer`\ ,
+    so acquisition never waits on analysis.
+
+    .. code-block:: python
+
+        import struct
+        import microlab_instruments as mi
+
+        def mean_current(block):
+            data = block[:-1]
+            values = struct.unpack('<{0}f'.format(len(data) / 4), data)
+            return sum(values) / len(values)
+
+        yveltal = mi.Yveltal()
+        p = mi.AcquisitionPipeline(
+            source=lambda: yveltal.ask_binary(':fetch:arr:curr? (@1)'),
+            worker=mean_current, workers=4)
+        p.start()
+        # ...
+        p.stop()
+        for sequence, result in p.results():
+            print sequence, result
+        print p.stats()
+    """
+    def __init__(self, source, worker, workers=2, slots=64, slot_size=1 << 20,
+                 block_until_free=False):
+        """
+        :param callable source:
+            Called repeatedly on the acquisition thread.  Returns a raw block
+            (*str*), or ``None`` to end the stream.
+        :param callable worker:
+            Called in a worker process with each raw block.  Its return value
+            is collected by :meth:`.results`\ .  If it raises, the exception
+            is collected instead and counted in the ``'errors'`` of
+            :meth:`.stats`\ .
+        :param int workers:
+            Defaults to 2.  Number of worker processes.
+        :param int slots:
+            Defaults to 64.  See :class:`SharedRingBuffer`\ .
+        :param int slot_size:
+            Defaults to 1 MiB.  See :class:`SharedRingBuffer`\ .
+        :param bool block_until_free:
+            Defaults to ``False``, which drops blocks when all slots are full.
+            If ``True``, acquisition waits for a free slot instead.
+        """
+        self.source = source
+        self.worker = worker
+        self.workers = workers
+        self.block_until_free = block_until_free
+        self.buffer = SharedRingBuffer(slots, slot_size)
+        self.__results = multiprocessing.Queue()
+        self.__pending = []
+        self.__processed = multiprocessing.RawValue(ctypes.c_ulong, 0)
+        self.__errors = multiprocessing.RawValue(ctypes.c_ulong, 0)
+        self.__processed_lock = multiprocessing.Lock()
+        self.__stop = threading.Event()
+        self.__thread = None
+        self.__processes = []
+        self.__acquired = 0
+
+    def start(self):
+        """Start the worker processes and the acquisition thread.
+        """
+        self.__stop.clear()
+        for n in range(self.workers):
+            p = multiprocessing.Process(target=self.__consume)
+            p.daemon = True
+            p.start()
+            self.__processes.append(p)
+        self.__thread = threading.Thread(target=self.__produce)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self):
+        """Stop acquisition, let the workers finish the blocks already in the
+        buffer, and wait for them to exit.
+        """
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+        # Keep draining results, otherwise workers with results still queued
+        # cannot exit.
+        while any(p.is_alive() for p in self.__processes):
+            try:
+                self.__pending.append(self.__results.get(True, 0.1))
+            except Empty:
+                pass
+        for p in self.__processes:
+            p.join()
+        self.__processes = []
+
+    def __produce(self):
+        try:
+            while not self.__stop.is_set():
+                block = self.source()
+                if block is None:
+                    break
+                self.buffer.put(block, self.__acquired, self.block_until_free)
+                self.__acquired += 1
+        finally:
+            # Workers that died cannot free slots, so never wait on them
+            markers = 0
+            while markers < self.workers and any(p.is_alive() for p in self.__processes):
+                markers += self.buffer.close(1, timeout=0.1)
+
+    def __consume(self):
+        while True:
+            sequence, block = self.buffer.get()
+            if block is None:
+                break
+            try:
+                result = self.worker(block)
+            except Exception, e:
+                result = e
+                with self.__processed_lock:
+                    self.__errors.value += 1
+            self.__results.put((sequence, result))
+            with self.__processed_lock:
+                self.__processed.value += 1
+
+    def results(self):
+        """A generator that yields ``(sequence, result)`` pairs that are ready,
+        without waiting.  Results may be out of order when there are several
+        workers.
+        """
+        while self.__pending:
+            yield self.__pending.pop(0)
+        while True:
+            try:
+                yield self.__results.get_nowait()
+            except Empty:
+                break
+
+    def stats(self):
+        """Returns block counters.
+
+        :returns out:
+            A mapping with the keys ``'acquired'``\ , ``'buffered'``\ ,
+            ``'dropped'``\ , ``'oversize'``\ , ``'processed'``\ , and
+            ``'errors'``\ .
+        :rtype: dict
+        """
+        out = {
+            'acquired'  : self.__acquired,
+            'buffered'  : self.buffer.written,
+            'dropped'   : self.buffer.dropped,
+            'oversize'  : self.buffer.oversize,
+            'processed' : self.__processed.value,
+            'errors'    : self.__errors.value,
+            }
+        return out
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+.. module:: reducers
+   :synopsis: Summarizes long measurement streams in constant memory.
+
+A reducer is updated with one chunk of values at a time, for example every
+block returned by :meth:`~base_classes.SCPIInstrument.read_ieee754`\ , and
+keeps only its summary.  Chunks may be *list*\ s, ``array``\ s, or NumPy
+arrays.  If NumPy is installed, each chunk is processed with vectorized
+operations.
+
+.. code-block:: python
+
+    import microlab_instruments as mi
+
+    stats = mi.RunningStats()
+    hist = mi.Histogram(0, 1e-3, bins=100)
+    yveltal.attach_reducers([stats, hist])
+    yveltal.start_logging(100000, 1e-3)
+    for readings in yveltal.log():
+        pass  # the readings need not be kept
+    print stats.mean, stats.std, hist.counts
+"""
+
+import math
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def _values(chunk):
+    """Returns ``chunk`` as a NumPy array of doubles if NumPy is installed,
+    or unchanged otherwise.
+    """
+    if np is not None:
+        return np.asarray(chunk, dtype=np.float64).ravel()
+    return chunk
+
+
+class RunningStats(object):
+    """Count, mean, and variance of a stream, by Welford's method.  Each chunk
+    is summarized on its own and merged into the running totals, which is
+    both vectorizable and numerically stable.
+    """
+    def __init__(self):
+        #: Number of values seen.
+        self.count = 0
+        #: Mean of the values seen.
+        self.mean = 0.0
+        self.__m2 = 0.0
+
+    def update(self, chunk):
+        x = _values(chunk)
+        n = len(x)
+        if not n:
+            return
+        if np is not None:
+            mean = float(x.mean())
+            m2 = float(((x - mean) ** 2).sum())
+        else:
+            mean = math.fsum(x) / n
+            m2 = math.fsum([(v - mean) ** 2 for v in x])
+        total = self.count + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.__m2 += m2 + delta * delta * self.count * n / total
+        self.count = total
+
+    @property
+    def variance(self):
+        """Sample variance of the values seen.
+        """
+        if self.count < 2:
+            return 0.0
+        return self.__m2 / (self.count - 1)
+
+    @property
+    def std(self):
+        """Sample standard deviation of the values seen.
+        """
+        return math.sqrt(self.variance)
+
+
+class MinMax(object):
+    """Smallest and largest values of a stream.  Both are ``None`` until the
+    first value is seen.
+    """
+    def __init__(self):
+        self.min = None
+        self.max = None
+
+    def update(self, chunk):
+        x = _values(chunk)
+        if not len(x):
+            return
+        if np is not None:
+            lo, hi = float(x.min()), float(x.max())
+        else:
+            lo, hi = min(x), max(x)
+        self.min = lo if self.min is None else min(self.min, lo)
+        self.max = hi if self.max is None else max(self.max, hi)
+
+
+class Histogram(object):
+    """Counts of a stream in ``bins`` equal bins from ``low`` to ``high``\ .
+    Values outside the range are counted in :attr:`underflow` and
+    :attr:`overflow`\ .
+    """
+    def __init__(self, low, high, bins=100):
+        if high <= low:
+            raise Exception, 'high must be greater than low'
+        self.low = low
+        self.high = high
+        self.bins = bins
+        #: Count of each bin, as an ``array('L')``\ .
+        self.counts = array('L', [0] * bins)
+        #: Number of values below ``low``\ .
+        self.underflow = 0
+        #: Number of values at or above ``high``\ .
+        self.overflow = 0
+        self.__width = float(high - low) / bins
+
+    @property
+    def edges(self):
+        """The ``bins + 1`` bin edges.
+        """
+        return [self.low + n * self.__width for n in range(self.bins + 1)]
+
+    def update(self, chunk):
+        x = _values(chunk)
+        if np is not None:
+            under = x < self.low
+            over = x >= self.high
+            self.underflow += int(under.sum())
+            self.overflow += int(over.sum())
+            inside = x[~(under | over)]
+            index = ((inside - self.low) / self.__width).astype(np.intp)
+            # Rounding may put values just below ``high`` past the last bin
+            index = np.minimum(index, self.bins - 1)
+            for n, c in enumerate(np.bincount(index, minlength=self.bins)):
+                self.counts[n] += int(c)
+            return
+        for v in x:
+            if v < self.low:
+                self.underflow += 1
+            elif v >= self.high:
+                self.overflow += 1
+            else:
+                self.counts[min(int((v - self.low) / self.__width), self.bins - 1)] += 1
+
+
+class Decimator(object):
+    """Averages every ``factor`` consecutive values of a stream into one, so
+    that a long stream is kept at a lower rate.  Values left over at the end
+    of a chunk are carried into the next one.
+    """
+    def __init__(self, factor):
+        self.factor = factor
+        #: The averages so far, as an ``array('d')``\ .
+        self.values = array('d')
+        self.__carry = []
+
+    def update(self, chunk):
+        if np is not None:
+            x = np.concatenate([self.__carry, _values(chunk)])
+        else:
+            x = list(self.__carry)
+            x.extend(chunk)
+        full = len(x) - len(x) % self.factor
+        self.__carry = x[full:]
+        if not full:
+            return
+        if np is not None:
+            means = x[:full].reshape(-1, self.factor).mean(axis=1)
+            self.values.extend(means.tolist())
+        else:
+            self.values.extend([math.fsum(x[n:n+self.factor]) / self.factor
+                                for n in xrange(0, full, self.factor)])
+
+
+def reduce_stream(chunks, *reducers):
+    """Update ``reducers`` with every chunk of ``chunks``\ , for example the
+    blocks yielded by :meth:`~base_classes.SourceMeasureInstrument.log`\ .
+
+    :returns out:
+        ``reducers``\ .
+    :rtype: tuple
+    """
+    for chunk in chunks:
+        for r in reducers:
+            r.update(chunk)
+    return reducers
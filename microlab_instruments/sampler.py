@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+.. module:: sampler
+   :synopsis: Samples temperature sensors in the background.
+"""
+
+import threading
+import time
+from array import array
+
+
+class TempSampler(object):
+    """Reads a set of :class:`~base_classes.TempSensorInstrument`\ s on its own
+    thread at a fixed rate.  Every reading is stored as a record of the form::
+
+        (timestamp, nickname, temperature, status, crc_ok)
+
+    in a fixed-size ring buffer.  Older records are overwritten once the
+    buffer is full.  Queries never wait for the sensors.
+
+    .. code-block:: python
+
+        import microlab_instruments as mi
+
+        aa = mi.Aardvark()
+        chen = mi.Chen(aa)
+        sampler = mi.TempSampler([mi.Traxex(aa, chen), mi.Xin(aa, chen)], rate=2)
+        sampler.start()
+        # ... measure something ...
+        print sampler.latest('traxex')
+        records = sampler.window(t_start, t_stop)
+        sampler.stop()
+    """
+    def __init__(self, sensors, rate=1.0, size=4096, reducers=None):
+        """Initialize the sampler.  Sampling begins on :meth:`.start`\ .
+
+        :param list sensors:
+            The temperature sensors to sample.
+        :param float rate:
+            Defaults to 1.  Number of sweeps over all ``sensors`` per second.
+        :param int size:
+            Defaults to 4096.  Number of records kept in the ring buffer.
+        :param dict reducers:
+            Defaults to ``None``.  Maps sensor nicknames to lists of
+            reducers, which are updated with every temperature of that
+            sensor, so that statistics cover more than the ring buffer.  See
+            :mod:`reducers`\ .
+        """
+        self.sensors = list(sensors)
+        self.period = 1.0 / rate
+        self.size = size
+        self.reducers = reducers or {}
+        #: Number of sensor readings that failed.
+        self.errors = 0
+        self.__timestamp = array('d', [0.0] * size)
+        self.__value = array('d', [0.0] * size)
+        self.__sensor = array('B', [0] * size)
+        self.__status = array('B', [0] * size)
+        self.__crc_ok = array('B', [0] * size)
+        self.__count = 0
+        self.__lock = threading.Lock()
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    def start(self):
+        """Start sampling on a background thread.
+        """
+        if self.__thread is not None and self.__thread.is_alive():
+            return
+        self.__stop.clear()
+        self.__thread = threading.Thread(target=self.__run)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self):
+        """Stop sampling and wait for the background thread to finish.
+        """
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+    def __run(self):
+        deadline = time.time()
+        while not self.__stop.is_set():
+            self.sweep()
+            deadline += self.period
+            delay = deadline - time.time()
+            if delay < 0:
+                # Overran; skip the missed sweeps instead of bursting
+                deadline = time.time()
+                delay = 0
+            self.__stop.wait(delay)
+
+    def sweep(self):
+        """Read every sensor once and store the records.  Called by the
+        background thread, but may also be called directly.
+        """
+        started = []
+        for n, sensor in enumerate(self.sensors):
+            try:
+                sensor.start_measurement()
+                started.append((n, sensor))
+            except Exception:
+                self.errors += 1
+        for n, sensor in started:
+            try:
+                temp, status, crc_ok = sensor.collect_sample()
+            except Exception:
+                self.errors += 1
+                continue
+            self.__append(time.time(), n, temp, status, crc_ok)
+            for r in self.reducers.get(sensor.DATA['nickname'], ()):
+                r.update([temp])
+
+    def __append(self, timestamp, sensor, value, status, crc_ok):
+        with self.__lock:
+            i = self.__count % self.size
+            self.__timestamp[i] = timestamp
+            self.__sensor[i] = sensor
+            self.__value[i] = value
+            self.__status[i] = status
+            self.__crc_ok[i] = crc_ok
+            self.__count += 1
+
+    def __record(self, i):
+        nickname = self.sensors[self.__sensor[i]].DATA['nickname']
+        out = (self.__timestamp[i], nickname, self.__value[i],
+               self.__status[i], bool(self.__crc_ok[i]))
+        return out
+
+    def __indices(self):
+        """Ring buffer indices from oldest to newest.  Must be called with
+        the lock held.
+        """
+        first = max(0, self.__count - self.size)
+        return [n % self.size for n in xrange(first, self.__count)]
+
+    def latest(self, nickname=None):
+        """Return the most recent record.
+
+        :param str nickname:
+            Defaults to ``None``.  If given, return the most recent record of
+            the sensor with this nickname.
+
+        :returns out:
+            A record, or ``None`` if there is none yet.
+        :rtype: tuple
+        """
+        with self.__lock:
+            for i in reversed(self.__indices()):
+                record = self.__record(i)
+                if nickname is None or record[1] == nickname:
+                    return record
+        return None
+
+    def window(self, start, stop=None, nickname=None):
+        """Return the records with timestamps between ``start`` and ``stop``\ ,
+        inclusive, oldest first.
+
+        :param float start:
+            Earliest timestamp, as returned by ``time.time()``\ .
+        :param float stop:
+            Defaults to ``None``, meaning up to the latest record.
+        :param str nickname:
+            Defaults to ``None``.  If given, return only records of the sensor
+            with this nickname.
+
+        :returns out:
+            A *list* of records.
+        :rtype: list
+        """
+        out = []
+        with self.__lock:
+            for i in self.__indices():
+                t = self.__timestamp[i]
+                if t < start or (stop is not None and t > stop):
+                    continue
+                record = self.__record(i)
+                if nickname is None or record[1] == nickname:
+                    out.append(record)
+        return out
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+.. module:: timing
+   :synopsis: Runs periodic measurement jobs on a fixed cadence.
+"""
+
+import ctypes
+import ctypes.util
+import math
+import os
+import threading
+import time
+from collections import deque
+
+
+class _timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+def _monotonic_clock():
+    """Returns a function reading ``CLOCK_MONOTONIC`` in seconds, or
+    ``time.time`` where that clock is not available.
+    """
+    try:
+        librt = ctypes.CDLL(ctypes.util.find_library('rt') or 'librt.so.1', use_errno=True)
+        clock_gettime = librt.clock_gettime
+    except (OSError, AttributeError):
+        return time.time
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_timespec)]
+    CLOCK_MONOTONIC = 1
+
+    def monotonic():
+        t = _timespec()
+        if clock_gettime(CLOCK_MONOTONIC, ctypes.byref(t)) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        return t.tv_sec + t.tv_nsec * 1e-9
+    return monotonic
+
+#: Seconds from an arbitrary point, unaffected by changes to the system clock.
+monotonic = _monotonic_clock()
+
+
+class Job(object):
+    """A periodic job of a :class:`MeasurementScheduler`\ .  Each run is
+    recorded as a tuple of the form::
+
+        (scheduled, actual, timestamp, result)
+
+    where ``scheduled`` and ``actual`` are :func:`monotonic` times,
+    ``timestamp`` is the wall-clock ``time.time()`` of the run, and
+    ``result`` is the return value of the job function.
+    """
+    def __init__(self, name, function, period, offset=0.0, catch_up=False,
+                 history=1000):
+        self.name = name
+        self.function = function
+        self.period = period
+        self.offset = offset
+        self.catch_up = catch_up
+        self.records = deque(maxlen=history)
+        #: Number of runs.
+        self.runs = 0
+        #: Number of runs that started after the next deadline had passed.
+        self.overruns = 0
+        #: Number of deadlines skipped to recover from overruns.
+        self.skipped = 0
+        #: Number of runs that raised an exception.
+        self.errors = 0
+        self.deadline = None
+        self.__sum = 0.0
+        self.__sum_sq = 0.0
+        self.__max = 0.0
+
+    def _record(self, scheduled, actual, timestamp, result):
+        jitter = actual - scheduled
+        self.runs += 1
+        self.__sum += jitter
+        self.__sum_sq += jitter * jitter
+        self.__max = max(self.__max, abs(jitter))
+        self.records.append((scheduled, actual, timestamp, result))
+
+    def stats(self):
+        """Returns the jitter statistics of this job, in seconds.
+
+        :returns out:
+            A mapping with the keys ``'runs'``\ , ``'mean'``\ , ``'std'``\ ,
+            ``'max'``\ , ``'overruns'``\ , ``'skipped'``\ , and ``'errors'``\ .
+        :rtype: dict
+        """
+        n = self.runs
+        mean = self.__sum / n if n else 0.0
+        variance = self.__sum_sq / n - mean * mean if n else 0.0
+        out = {
+            'runs'     : n,
+            'mean'     : mean,
+            'std'      : math.sqrt(max(variance, 0.0)),
+            'max'      : self.__max,
+            'overruns' : self.overruns,
+            'skipped'  : self.skipped,
+            'errors'   : self.errors,
+            }
+        return out
+
+
+class MeasurementScheduler(object):
+    """Runs declared periodic jobs on one thread against monotonic-clock
+    deadlines.  Deadlines are computed from the start time, not from the end
+    of the previous run, so the cadence does not drift.  Jobs run one at a
+    time, so instruments never see concurrent access from the scheduler.
+
+    .. code-block:: python
+
+        import microlab_instruments as mi
+
+        s = mi.MeasurementScheduler()
+        s.add_job('current', lambda: yveltal.ask_ieee754(':fetch:curr? (@1)'), period=0.1)
+        s.add_job('scope', deoxys.ask_waveform_data, period=1.0)
+        s.add_job('temp', lambda: mi.read_temps([traxex, xin]), period=2.0)
+        s.start()
+        # ...
+        s.stop()
+        print s.jobs['current'].stats()
+    """
+    #: Sleep until this many seconds before a deadline, then spin.
+    SPIN = 0.002
+
+    def __init__(self):
+        #: Jobs by name.
+        self.jobs = {}
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    def add_job(self, name, function, period, offset=0.0, catch_up=False,
+                history=1000):
+        """Declare a periodic job.
+
+        :param str name:
+            A unique name for the job.
+        :param callable function:
+            Called with no arguments at every deadline.
+        :param float period:
+            Seconds between deadlines.
+        :param float offset:
+            Defaults to 0.  Seconds from :meth:`.start` to the first deadline.
+        :param bool catch_up:
+            Defaults to ``False``, which skips deadlines that have already
+            passed after an overrun.  If ``True``, missed deadlines are run
+            back to back until the job is on schedule again.
+        :param int history:
+            Defaults to 1000.  Number of run records kept for the job.
+
+        :returns out:
+            The new job.
+        :rtype: Job
+        """
+        job = Job(name, function, period, offset, catch_up, history)
+        self.jobs[name] = job
+        return job
+
+    def start(self):
+        """Start running the jobs on a background thread.
+        """
+        origin = monotonic()
+        for job in self.jobs.values():
+            job.deadline = origin + job.offset
+        self.__stop.clear()
+        self.__thread = threading.Thread(target=self.__run)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self):
+        """Stop running the jobs.  A job that is already running finishes
+        first.
+        """
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+    def __run(self):
+        while not self.__stop.is_set() and self.jobs:
+            job = min(self.jobs.values(), key=lambda j: j.deadline)
+            if not self.__wait_until(job.deadline):
+                break
+            self.__run_job(job)
+
+    def __wait_until(self, deadline):
+        """Sleep until shortly before ``deadline``\ , then spin.  Returns
+        ``False`` if the scheduler was stopped in the meantime.
+        """
+        delay = deadline - monotonic() - self.SPIN
+        if delay > 0 and self.__stop.wait(delay):
+            return False
+        while monotonic() < deadline:
+            pass
+        return not self.__stop.is_set()
+
+    def __run_job(self, job):
+        scheduled = job.deadline
+        actual = monotonic()
+        timestamp = time.time()
+        try:
+            result = job.function()
+        except Exception, e:
+            job.errors += 1
+            result = e
+        job._record(scheduled, actual, timestamp, result)
+
+        job.deadline = scheduled + job.period
+        now = monotonic()
+        if job.deadline < now:
+            job.overruns += 1
+            if not job.catch_up:
+                missed = int((now - job.deadline) / job.period) + 1
+                job.skipped += missed
+                job.deadline += missed * job.period
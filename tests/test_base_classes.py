@@ -0,0 +1,693 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_base_classes
+-----------------
+
+Tests for `base_classes` module.
+"""
+
+import errno
+import os
+import pty
+import socket
+import struct
+import tempfile
+import threading
+import time
+import unittest
+from array import array
+
+from microlab_instruments import base_classes as bc
+from microlab_instruments.reducers import RunningStats
+
+try:
+    import serial
+except ImportError:
+    serial = None
+
+
+class FakeSCPI(bc.SCPIInstrument):
+    """Answers queries from a list of canned responses and records writes.
+    """
+    DATA = {
+        'nickname'        : 'fake',
+        'get_byte_order'  : ':format:border?',
+        'get_data_format' : ':format:data?',
+        }
+
+    def __init__(self, responses=()):
+        self.written = []
+        self.responses = list(responses)
+
+    def write(self, scpi_string):
+        self.written.append(scpi_string)
+        self._command_sent(scpi_string)
+
+    def read_ascii(self, bufsize=4096):
+        return self.responses.pop(0)
+
+
+class TestErrorChecking(unittest.TestCase):
+
+    def test_piggyback_returns_response(self):
+        i = FakeSCPI(['1.5;+0,"No error"\n'])
+        i.enable_error_checking(piggyback=True)
+        self.assertEqual(i.ask_ascii(':sour:volt?'), '1.5\n')
+        self.assertEqual(i.written, [':sour:volt?;:SYST:ERR?'])
+
+    def test_piggyback_failed_query_raises(self):
+        i = FakeSCPI(['-113,"Undefined header"\n', '+0,"No error"\n'])
+        i.enable_error_checking(piggyback=True, raise_errors=False)
+        with self.assertRaises(bc.SCPIError) as e:
+            i.ask_ascii(':sour:voltt?')
+        self.assertEqual(e.exception.errors[0][0], -113)
+
+    def test_piggyback_message_with_semicolon(self):
+        i = FakeSCPI(['1.5;-222,"Data out of range;:SOUR:VOLT 99"\n', '+0,"No error"\n'])
+        i.enable_error_checking(piggyback=True, raise_errors=False)
+        i.write(':sour:volt 99')
+        self.assertEqual(i.ask_ascii(':sour:volt?'), '1.5\n')
+        self.assertEqual(i.error_log[0][:2], (-222, 'Data out of range;:SOUR:VOLT 99'))
+        self.assertEqual(i.error_log[0][2], [':sour:volt 99'])
+
+    def test_piggyback_failed_query_message_with_semicolon(self):
+        i = FakeSCPI(['-113,"Undefined header;:SOUR:VOLTT?"\n', '+0,"No error"\n'])
+        i.enable_error_checking(piggyback=True, raise_errors=False)
+        with self.assertRaises(bc.SCPIError) as e:
+            i.ask_ascii(':sour:voltt?')
+        self.assertEqual(e.exception.errors[0][:2], (-113, 'Undefined header;:SOUR:VOLTT?'))
+
+    def test_errors_are_attributed(self):
+        i = FakeSCPI(['-113,"Undefined header; SOUR:VOLT:STOPP"\n', '+0,"No error"\n'])
+        i.enable_error_checking()
+        i.write(':sour:volt:start 0')
+        i.write(':sour:volt:stopp 5')
+        with self.assertRaises(bc.SCPIError) as e:
+            i.check_errors()
+        self.assertEqual(e.exception.errors[0][2], [':sour:volt:stopp 5'])
+
+
+class TestQueryCache(unittest.TestCase):
+
+    def setUp(self):
+        self.i = FakeSCPI(['{0}\n'.format(n) for n in range(10)])
+        self.i.enable_query_cache({':format:border?': None,
+                                   ':source:voltage?': None,
+                                   ':sens:curr:prot?': None}, size=2)
+
+    def test_short_and_long_forms_share_an_entry(self):
+        self.assertEqual(self.i.ask_ascii(':FORM:BORD?'), '0\n')
+        self.assertEqual(self.i.ask_ascii(':format:border?'), '0\n')
+        self.assertEqual(self.i.cache_stats()['hits'], 1)
+
+    def test_write_invalidates_subsystem(self):
+        self.i.ask_ascii(':form:bord?')
+        self.i.write(':sour:volt 1')
+        self.assertEqual(self.i.ask_ascii(':form:bord?'), '0\n')
+        self.i.write(':format:data real,64')
+        self.assertEqual(self.i.ask_ascii(':form:bord?'), '1\n')
+
+    def test_default_root_nodes(self):
+        self.i.ask_ascii(':sour:volt?')
+        self.i.ask_ascii(':sens:curr:prot?')
+        self.i.write(':volt 1.5')
+        self.i.write(':curr:prot 0.1')
+        self.assertEqual(self.i.ask_ascii(':sour:volt?'), '2\n')
+        self.assertEqual(self.i.ask_ascii(':sens:curr:prot?'), '3\n')
+
+    def test_reset_and_eviction(self):
+        self.i.ask_ascii(':form:bord?')
+        self.i.ask_ascii(':sour:volt?')
+        self.i.ask_ascii(':sens:curr:prot?')
+        self.assertEqual(self.i.cache_stats()['evictions'], 1)
+        self.i.write('*RST')
+        self.assertEqual(self.i.cache_stats()['size'], 0)
+
+    def test_preset(self):
+        self.i.ask_ascii(':form:bord?')
+        self.i.write(':system:preset')
+        self.assertEqual(self.i.cache_stats()['size'], 0)
+        self.assertEqual(self.i.ask_ascii(':form:bord?'), '1\n')
+
+    def test_uncached_queries(self):
+        self.assertEqual(self.i.ask_ascii(':meas:volt?'), '0\n')
+        self.assertEqual(self.i.ask_ascii(':meas:volt?'), '1\n')
+
+
+class TestBusScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.bus = bc.BusScheduler()
+        self.order = []
+
+    def waiter(self, name, priority):
+        """Start a thread that records ``name`` once it gets the bus, and
+        return after it is queued.
+        """
+        def run():
+            with self.bus.transaction(priority):
+                self.order.append(name)
+        queued = len(self.bus._BusScheduler__waiting) + 1
+        t = threading.Thread(target=run)
+        t.start()
+        while len(self.bus._BusScheduler__waiting) < queued:
+            time.sleep(0.001)
+        return t
+
+    def test_priority_handoff(self):
+        self.bus.acquire()
+        threads = [self.waiter('low', bc.BusScheduler.LOW),
+                   self.waiter('low2', bc.BusScheduler.LOW),
+                   self.waiter('normal', bc.BusScheduler.NORMAL),
+                   self.waiter('high', bc.BusScheduler.HIGH)]
+        self.bus.release()
+        for t in threads:
+            t.join(5)
+        self.assertEqual(self.order, ['high', 'normal', 'low', 'low2'])
+
+    def test_reentrant(self):
+        with self.bus.transaction(bc.BusScheduler.LOW):
+            with self.bus.transaction(bc.BusScheduler.HIGH):
+                t = self.waiter('other', bc.BusScheduler.HIGH)
+            # Still held by the outer transaction
+            time.sleep(0.01)
+            self.assertEqual(self.order, [])
+        t.join(5)
+        self.assertEqual(self.order, ['other'])
+
+    def test_release_by_other_thread(self):
+        self.bus.acquire()
+        errors = []
+
+        def release():
+            try:
+                self.bus.release()
+            except Exception, e:
+                errors.append(e)
+        t = threading.Thread(target=release)
+        t.start()
+        t.join(5)
+        self.bus.release()
+        self.assertEqual(len(errors), 1)
+
+
+class FakeSMU(bc.SourceMeasureInstrument):
+    """Answers every binary query with ``block`` as little-endian doubles.
+    """
+    DATA = {
+        'nickname'          : 'yveltal',
+        'get_byte_order'    : ':format:border?',
+        'byte_order_little' : 'SWAP',
+        'get_data_format'   : ':format:data?',
+        'data_format_single': 'REAL,32',
+        'data_format_double': 'REAL,64',
+        }
+
+    def __init__(self, block):
+        self._socket = None
+        self.block = block
+        self.written = []
+
+    def write(self, scpi_string):
+        self.written.append(scpi_string)
+
+    def read_ascii(self, bufsize=4096):
+        return {':format:border?': 'SWAP\n',
+                ':format:data?': 'REAL,64\n'}[self.written[-1]]
+
+    def read_binary(self):
+        return struct.pack('<{0}d'.format(len(self.block)), *self.block) + '\n'
+
+
+class TestReducerHook(unittest.TestCase):
+
+    def test_plain_reads(self):
+        smu = FakeSMU([1.0, 2.0, 3.0])
+        stats = RunningStats()
+        smu.attach_reducers([stats])
+        smu.ask_ieee754(':fetch:arr:curr? (@1)')
+        self.assertEqual((stats.count, stats.mean), (3, 2.0))
+        smu.detach_reducers()
+        smu.ask_ieee754(':fetch:arr:curr? (@1)')
+        self.assertEqual(stats.count, 3)
+
+    def test_interleaved_reads_are_not_mixed(self):
+        # Two points of (VOLT, CURR) on channels 1 and 2
+        smu = FakeSMU([1.0, 0.1, 2.0, 0.2, 1.5, 0.3, 2.5, 0.4])
+        everything = RunningStats()
+        current2 = RunningStats()
+        smu.attach_reducers([everything])
+        smu.attach_reducers([current2], offset=3, stride=4)
+        data = smu.fetch_channels()
+        self.assertEqual(list(data[2]['CURR']), [0.2, 0.4])
+        self.assertEqual(everything.count, 0)
+        self.assertEqual(current2.count, 2)
+        self.assertAlmostEqual(current2.mean, 0.3)
+
+
+class LoggingSMU(FakeSMU):
+    """Serves ``logged`` from the trace buffer of channel 1, and reports the
+    Standard Operation condition ``condition``\ .
+    """
+    def __init__(self, logged, condition=0):
+        FakeSMU.__init__(self, [])
+        self.logged = logged
+        self.condition = condition
+
+    def read_ascii(self, bufsize=4096):
+        query = self.written[-1]
+        if query == ':trace1:points:actual?':
+            return '{0}\n'.format(len(self.logged))
+        if query == ':status:operation:condition?':
+            return '{0}\n'.format(self.condition)
+        return FakeSMU.read_ascii(self, bufsize)
+
+    def read_binary(self):
+        start, size = [int(n) for n in self.written[-1].split()[1].split(',')]
+        self.block = self.logged[start:start + size]
+        return FakeSMU.read_binary(self)
+
+
+class TestLogging(unittest.TestCase):
+
+    def test_complete_log(self):
+        smu = LoggingSMU([0.1, 0.2, 0.3])
+        smu.start_logging(3, 1e-3)
+        self.assertEqual(list(smu.log(max_readings=2, poll=0)), [[0.1, 0.2], [0.3]])
+
+    def test_stop_logging_ends_log(self):
+        smu = LoggingSMU([0.1, 0.2])
+        smu.start_logging(10, 1e-3)
+        blocks = smu.log(poll=0)
+        self.assertEqual(next(blocks), [0.1, 0.2])
+        smu.logged.append(0.3)
+        smu.stop_logging()
+        # Readings logged before the abort are still yielded
+        self.assertEqual(list(blocks), [[0.3]])
+
+    def test_idle_acquisition_ends_log(self):
+        smu = LoggingSMU([0.1, 0.2], condition=bc.SourceMeasureInstrument.ACQUIRE_IDLE[1])
+        smu.start_logging(10, 1e-3)
+        self.assertEqual(list(smu.log(poll=0)), [[0.1, 0.2]])
+
+
+class FakeSocket(object):
+    """Records everything sent, and answers from a canned byte stream.
+    """
+    def __init__(self, stream=''):
+        self.sent = []
+        self.stream = stream
+
+    def sendall(self, s):
+        self.sent.append(str(s))
+
+    def recv(self, bufsize):
+        out, self.stream = self.stream[:bufsize], self.stream[bufsize:]
+        return out
+
+    def settimeout(self, timeout):
+        pass
+
+    def shutdown(self, how):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeGenerator(bc.SignalGeneratorInstrument):
+    DATA = {'nickname': 'fake'}
+
+    def _connect(self):
+        self._socket = FakeSocket()
+
+
+class TestBlockWrites(unittest.TestCase):
+
+    def setUp(self):
+        self.generator = FakeGenerator(('localhost', 5025), reset=False)
+        self.sent = self.generator._socket.sent
+
+    def test_upload_waveform(self):
+        self.generator.upload_waveform('TONE', 'abcd' * 5, chunk_size=8)
+        self.assertEqual(''.join(self.sent), ':memory:data "WFM1:TONE",#220' + 'abcd' * 5 + '\n')
+        self.assertEqual(len(self.sent), 5)
+
+    def test_upload_waveform_does_not_read_files(self):
+        self.generator.upload_waveform('NAME', 'capture.iq')
+        self.assertEqual(''.join(self.sent), ':memory:data "WFM1:NAME",#210capture.iq\n')
+
+    def test_upload_waveform_from_file(self):
+        fd, filename = tempfile.mkstemp()
+        try:
+            os.write(fd, '\x7f\xff' * 3)
+            os.close(fd)
+            self.generator.upload_waveform_from_file('CAPTURE', filename)
+        finally:
+            os.remove(filename)
+        self.assertEqual(''.join(self.sent), ':memory:data "WFM1:CAPTURE",#16' + '\x7f\xff' * 3 + '\n')
+
+
+class TimeoutSocket(FakeSocket):
+    def recv(self, bufsize):
+        raise socket.timeout('timed out')
+
+
+class FakeTCPIP(bc.TCPIPInstrument):
+    DATA = {'nickname': 'fake', 'init_commands': (':format:data real,32',)}
+
+    def _connect(self):
+        self._socket = self.sockets.pop(0)
+
+
+class TestTCPIPReconnect(unittest.TestCase):
+
+    def connect(self, *sockets):
+        FakeTCPIP.sockets = list(sockets)
+        return FakeTCPIP(('localhost', 5025), reset=False, backoff=0)
+
+    def test_timeout_keeps_connection(self):
+        i = self.connect(TimeoutSocket())
+        self.assertRaises(socket.timeout, i.ask_ascii, '*OPC?')
+        self.assertEqual((i.reconnects, i.retries), (0, 0))
+        self.assertEqual(i._socket.sent, [':format:data real,32\n', '*OPC?\n'])
+
+    def test_closed_connection_is_reestablished(self):
+        second = FakeSocket('1\n')
+        i = self.connect(FakeSocket(''), second)
+        self.assertEqual(i.ask_ascii('*OPC?'), '1\n')
+        self.assertEqual((i.reconnects, i.retries), (1, 1))
+        # The init commands are replayed before the query is sent again
+        self.assertEqual(second.sent, [':format:data real,32\n', '*OPC?\n'])
+
+    def test_non_idempotent_query_is_not_retried(self):
+        i = self.connect(FakeSocket(''), FakeSocket('1\n'))
+        self.assertRaises(socket.error, i.ask_ascii, ':meas:volt?')
+        self.assertEqual((i.reconnects, i.retries), (1, 0))
+
+    def test_reconnect_clears_query_cache(self):
+        i = self.connect(FakeSocket('1.5\n'), FakeSocket('0\n'))
+        i.enable_query_cache({':sour:volt?': None})
+        self.assertEqual(i.ask_ascii(':sour:volt?'), '1.5\n')
+        i.reconnect()
+        self.assertEqual(i.ask_ascii(':sour:volt?'), '0\n')
+        self.assertEqual(i.cache_stats()['hits'], 0)
+
+    def test_compound_query_is_not_retried(self):
+        i = self.connect(FakeSocket(''), FakeSocket('1\n'))
+        self.assertRaises(socket.error, i.ask_ascii, ':sour:volt 1;:meas:curr?')
+        self.assertEqual((i.reconnects, i.retries), (1, 0))
+
+    def test_idempotent_headers(self):
+        i = self.connect(FakeSocket())
+        for query in (':output on;:read?', '*TRG;:fetch?', ':system:error?',
+                      ':sour:volt?;:initiate1', ':MEASURE:CURRENT? (@1)'):
+            self.assertFalse(i._is_idempotent(query), query)
+        for query in ('*IDN?', ':sour:volt 1;:fetch:arr:curr? (@1)', ':sour:volt?'):
+            self.assertTrue(i._is_idempotent(query), query)
+
+
+def broken_send(s):
+    raise socket.error(errno.ECONNRESET, 'Connection reset by peer')
+
+
+class TestCoalescing(unittest.TestCase):
+
+    def connect(self, *sockets, **options):
+        FakeTCPIP.sockets = list(sockets)
+        i = FakeTCPIP(('localhost', 5025), reset=False, backoff=0)
+        options.setdefault('max_delay', 60)
+        i.enable_coalescing(**options)
+        return i
+
+    def test_commands_are_sent_with_query(self):
+        i = self.connect(FakeSocket('1\n'))
+        i.write(':sour:volt 1')
+        i.write(':outp on')
+        self.assertEqual(i._socket.sent, [':format:data real,32\n'])
+        self.assertEqual(i.ask_ascii('*OPC?'), '1\n')
+        self.assertEqual(i._socket.sent[1:], [':sour:volt 1\n:outp on\n*OPC?\n'])
+
+    def test_compound_separator(self):
+        i = self.connect(FakeSocket('1\n'), separator=';')
+        i.write(':sour:volt 1')
+        i.ask_ascii('*OPC?')
+        self.assertEqual(i._socket.sent[1:], [':sour:volt 1;*OPC?\n'])
+
+    def test_max_bytes(self):
+        i = self.connect(FakeSocket(), max_bytes=30)
+        i.write(':sour:volt 1')
+        i.write(':sour:volt 2')
+        self.assertEqual(len(i._socket.sent), 1)
+        i.write(':sour:volt 3')
+        self.assertEqual(i._socket.sent[1:], [':sour:volt 1\n:sour:volt 2\n:sour:volt 3\n'])
+
+    def test_max_delay(self):
+        i = self.connect(FakeSocket(), max_delay=0)
+        i.write(':sour:volt 1')
+        self.assertEqual(i._socket.sent[1:], [':sour:volt 1\n'])
+
+    def test_flush_before_read(self):
+        i = self.connect(FakeSocket('1\n'))
+        i.write(':outp on')
+        i.read()
+        self.assertEqual(i._socket.sent[1:], [':outp on\n'])
+
+    def test_flush_before_write_block(self):
+        i = self.connect(FakeSocket())
+        i.write(':outp on')
+        i.write_block(':mem:data "X",', 'ab')
+        self.assertEqual(i._socket.sent[1:], [':outp on\n', ':mem:data "X",#12', 'ab', '\n'])
+
+    def test_disable_flushes(self):
+        i = self.connect(FakeSocket())
+        i.write(':outp on')
+        i.disable_coalescing()
+        i.write(':outp off')
+        self.assertEqual(i._socket.sent[1:], [':outp on\n', ':outp off\n'])
+
+    def test_reconnect_during_flush(self):
+        first, second = FakeSocket(), FakeSocket()
+        i = self.connect(first, second)
+        i.write(':sour:volt 1')
+        i.write(':outp on')
+        first.sendall = broken_send
+        i.flush()
+        self.assertEqual(i.reconnects, 1)
+        # The init commands go out ahead of the resent payload
+        self.assertEqual(second.sent, [':format:data real,32\n', ':sour:volt 1\n:outp on\n'])
+
+
+class FakeLogicAnalyzer(bc.LogicAnalyzerInstrument):
+    DATA = {'nickname': 'fake', 'capture_query': ':data?', 'sample_bytes': 4}
+
+    def _connect(self):
+        # Sample n holds n on bits 0-15 and its parity on bit 16
+        samples = ''.join([struct.pack('<I', n | (n & 1) << 16) for n in range(20)])
+        self._socket = FakeSocket('#2{0}{1}\n'.format(len(samples), samples))
+
+
+class TestLogicAnalyzer(unittest.TestCase):
+
+    def setUp(self):
+        self.analyzer = FakeLogicAnalyzer(('localhost', 5025), reset=False)
+
+    def test_fetch_capture(self):
+        n, data = self.analyzer.fetch_capture({'ADDR': (0, 16), 'CLK': (16, 1)},
+                                              chunk_samples=8)
+        self.assertEqual(n, 20)
+        self.assertEqual(list(data['ADDR']), range(20))
+        # 0101... packed most significant bit first
+        self.assertEqual(list(data['CLK']), [0x55, 0x55, 0x50])
+
+    def test_window_query(self):
+        self.analyzer.fetch_capture({'ADDR': (0, 16)}, start=5)
+        self.analyzer._socket.stream = '#10\n'
+        self.analyzer.fetch_capture({'ADDR': (0, 16)}, start=5, stop=10)
+        self.assertEqual(self.analyzer._socket.sent, [':data? 5\n', ':data? 5,10\n'])
+
+class StubAardvark(object):
+    """Stands in for an Aardvark on a bus with one device of 256 registers,
+    recording every transfer.  The first ``nacks`` reads are not
+    acknowledged.
+    """
+    def __init__(self, nacks=0):
+        self.bus = bc.BusScheduler()
+        self.registers = [0] * 256
+        self.transfers = []
+        self.nacks = nacks
+        self.response = None
+
+    def transaction(self, priority=None):
+        return self.bus.transaction(priority)
+
+    def i2c_write(self, slave_address, data):
+        self.transfers.append(('write', slave_address, data))
+
+    def i2c_write_block(self, slave_address, bytecodes):
+        self.transfers.append(('write', slave_address, list(bytecodes)))
+        register = bytecodes[0]
+        self.registers[register:register + len(bytecodes) - 1] = bytecodes[1:]
+        return len(bytecodes)
+
+    def i2c_write_read(self, slave_address, register, bufsize):
+        self.transfers.append(('read', slave_address, register, bufsize))
+        return array('B', self.registers[register:register + bufsize])
+
+    def i2c_read(self, slave_address, bufsize):
+        self.transfers.append(('read', slave_address, bufsize))
+        if self.nacks:
+            self.nacks -= 1
+            raise Exception(bc.AardvarkInstrument.I2C_STATUS_CODES[3])
+        return array('B', self.response)
+
+
+class FakeFPGA(bc.FPGAInstrument):
+    DATA = {'address': 0x55, 'volatile_registers': (0x10,)}
+
+
+class TestFPGA(unittest.TestCase):
+
+    def setUp(self):
+        self.aa = StubAardvark()
+        self.fpga = FakeFPGA(self.aa, shadow=True)
+
+    def test_redundant_write_is_skipped(self):
+        self.assertEqual(self.fpga.write_burst(0x01, [1, 2]), 3)
+        self.assertEqual(self.fpga.write_burst(0x01, [1, 2]), 0)
+        self.assertEqual(self.fpga.write_burst(0x01, [1, 3]), 3)
+        self.assertEqual(len(self.aa.transfers), 2)
+
+    def test_shadow_reads(self):
+        self.fpga.write_burst(0x01, [1, 2])
+        self.assertEqual(list(self.fpga.read_burst(0x01, 2)), [1, 2])
+        self.assertEqual(len(self.aa.transfers), 1)
+        self.fpga.invalidate(0x02)
+        self.assertEqual(list(self.fpga.read_burst(0x01, 2)), [1, 2])
+        self.assertEqual(self.aa.transfers[-1], ('read', 0x55, 0x01, 2))
+
+    def test_volatile_registers_go_to_hardware(self):
+        self.fpga.write(0x10, 7)
+        self.fpga.write(0x10, 7)
+        self.assertEqual(len(self.aa.transfers), 2)
+        self.aa.registers[0x10] = 9
+        self.assertEqual(list(self.fpga.read(0x10)), [9])
+        self.assertEqual(list(self.fpga.read_burst(0x0f, 2)), [0, 9])
+        self.assertEqual(len(self.aa.transfers), 4)
+
+    def test_read_modify_write_preserves_unmasked_bits(self):
+        self.aa.registers[0x11] = 0xc5
+        self.assertEqual(self.fpga.write_field(0x11, 0x30, 0b10), 0xe5)
+        self.assertEqual(self.aa.registers[0x11], 0xe5)
+        self.assertEqual(self.fpga.clear_bits(0x11, 0x81), 0x64)
+        self.assertEqual(self.fpga.read_field(0x11, 0x70), 0b110)
+        # Nothing is written when the bits already have the value
+        transfers = len(self.aa.transfers)
+        self.assertEqual(self.fpga.set_bits(0x11, 0x04), 0x64)
+        self.assertEqual(len(self.aa.transfers), transfers)
+
+
+class FakeMux(bc.I2CMuxInstrument):
+    DATA = {'address': 0x70}
+
+
+class FakeSensor(bc.TempSensorInstrument):
+    DATA = {'address': 0x4a, 'mux_address': 0x04}
+
+
+class TestTempSensor(unittest.TestCase):
+
+    def sensor(self, nacks):
+        self.aa = StubAardvark(nacks)
+        # 0x683A with status bits 0b10, and its checksum
+        self.aa.response = [0x68, 0x3a, 0x7c]
+        return FakeSensor(self.aa, FakeMux(self.aa))
+
+    def test_nack_polling(self):
+        temp, status, crc_ok = self.sensor(3).collect_sample(interval=0.001)
+        self.assertEqual(len([t for t in self.aa.transfers if t[0] == 'read']), 4)
+        self.assertAlmostEqual(temp, -46.85 + 175.72 * 0x6838 / 2.0 ** 16)
+        self.assertEqual((status, crc_ok), (0b10, True))
+
+    def test_nack_timeout(self):
+        sensor = self.sensor(1000)
+        self.assertRaises(Exception, sensor.collect_sample,
+                          timeout=0.02, interval=0.001, max_interval=0.002)
+        self.assertTrue(1 < len(self.aa.transfers) < 1000)
+
+    def test_bad_checksum(self):
+        sensor = self.sensor(0)
+        self.aa.response = [0x68, 0x3a, 0x7d]
+        self.assertFalse(sensor.collect_sample()[2])
+
+    def test_crc8(self):
+        # Examples from the Sensirion SHT2x/STS21 datasheets
+        sensor = self.sensor(0)
+        self.assertEqual(sensor._crc8([0xdc]), 0x79)
+        self.assertEqual(sensor._crc8([0x68, 0x3a]), 0x7c)
+        self.assertEqual(sensor._crc8([0x4e, 0x85]), 0x6b)
+        self.assertEqual(sensor._crc8([0x63, 0x52]), 0x64)
+
+
+class PtyInstrument(object):
+    """Stands in for an RS-232 instrument on the master side of a pty.
+    """
+    RESPONSES = {
+        '*IDN?'  : 'FAKE,SERIAL,0,1.0\n',
+        ':DATA?' : '#210ABCDEFGHIJ\n',
+        }
+
+    def __init__(self):
+        self.master, slave = pty.openpty()
+        self.port = os.ttyname(slave)
+        self.commands = []
+        self.thread = threading.Thread(target=self.__run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __run(self):
+        pending = ''
+        while True:
+            try:
+                pending += os.read(self.master, 1024)
+            except OSError:
+                break
+            while '\n' in pending:
+                line, pending = pending.split('\n', 1)
+                self.commands.append(line)
+                if line in self.RESPONSES:
+                    os.write(self.master, self.RESPONSES[line])
+
+
+@unittest.skipIf(serial is None, 'pyserial is not installed')
+class TestSerialInstrument(unittest.TestCase):
+
+    def setUp(self):
+        self.stand_in = PtyInstrument()
+        self.instrument = bc.SerialInstrument(self.stand_in.port, timeout=2, reset=False)
+
+    def tearDown(self):
+        self.instrument._serial.close()
+
+    def test_ask_ascii(self):
+        self.assertEqual(self.instrument.ask_ascii('*IDN?'), 'FAKE,SERIAL,0,1.0\n')
+
+    def test_ask_binary(self):
+        self.assertEqual(self.instrument.ask_binary(':DATA?'), 'ABCDEFGHIJ\n')
+        # Nothing beyond the block was consumed
+        self.assertEqual(self.instrument.ask_ascii('*IDN?'), 'FAKE,SERIAL,0,1.0\n')
+
+    def test_writes(self):
+        self.instrument.write(':OUTP ON')
+        self.instrument.ask_ascii('*IDN?')
+        self.assertEqual(self.stand_in.commands, [':OUTP ON', '*IDN?'])
+
+    def test_loop_url(self):
+        loop = bc.SerialInstrument('loop://', timeout=1, reset=False)
+        loop.write('*IDN?')
+        self.assertEqual(loop.read_ascii(), '*IDN?\n')
+
+if __name__ == '__main__':
+    unittest.main()
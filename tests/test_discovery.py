@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_discovery
+--------------
+
+Tests for `discovery` module.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from microlab_instruments import discovery
+
+
+def b2962a(nickname, host, serial=None):
+    return {'nickname': nickname, 'name': 'Agilent B2962A Power Source',
+            'socket': (host, 5025), 'serial': serial}
+
+
+def idn(serial):
+    return 'Agilent Technologies,B2962A,{0},2.0.1225.5040\n'.format(serial)
+
+
+class TestMatch(unittest.TestCase):
+    def setUp(self):
+        self.known = [b2962a('genesect', '192.168.1.20'),
+                      b2962a('giratina', '192.168.1.21'),
+                      {'nickname': 'yveltal', 'name': 'Agilent B2902A Precision SMU',
+                       'socket': ('192.168.1.30', 5025)}]
+
+    def test_unique_model(self):
+        found = {'10.0.0.9': 'Agilent Technologies,B2902A,MY111,1.0\n'}
+        registry, unmatched = discovery.match(found, self.known)
+        self.assertEqual(registry, {'yveltal': ('10.0.0.9', 5025, 'MY111')})
+        self.assertEqual(unmatched, [])
+
+    def test_same_model_by_serial(self):
+        self.known[0]['serial'] = 'MY222'
+        self.known[1]['serial'] = 'MY333'
+        found = {'10.0.0.1': idn('MY333'), '10.0.0.2': idn('MY222')}
+        registry, unmatched = discovery.match(found, self.known)
+        self.assertEqual(registry, {'giratina': ('10.0.0.1', 5025, 'MY333'),
+                                    'genesect': ('10.0.0.2', 5025, 'MY222')})
+        self.assertEqual(unmatched, [])
+
+    def test_moved_unit_by_elimination(self):
+        found = {'192.168.1.21': idn('MY333'), '10.0.0.2': idn('MY222')}
+        registry, unmatched = discovery.match(found, self.known)
+        self.assertEqual(registry, {'giratina': ('192.168.1.21', 5025, 'MY333'),
+                                    'genesect': ('10.0.0.2', 5025, 'MY222')})
+        self.assertEqual(unmatched, [])
+
+    def test_known_serial_is_not_reassigned(self):
+        self.known[0]['serial'] = 'MY222'
+        found = {'192.168.1.20': idn('MY999')}
+        registry, unmatched = discovery.match(found, self.known)
+        self.assertEqual(registry, {'giratina': ('192.168.1.20', 5025, 'MY999')})
+
+    def test_both_moved_without_serials(self):
+        found = {'10.0.0.1': idn('MY333'), '10.0.0.2': idn('MY222')}
+        registry, unmatched = discovery.match(found, self.known)
+        self.assertEqual(registry, {})
+        self.assertEqual(sorted(unmatched), sorted(found.items()))
+
+
+class TestRegistry(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'registry.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_round_trip(self):
+        registry = {'genesect': ('10.0.0.2', 5025, 'MY222')}
+        discovery.save_registry(registry, self.path)
+        self.assertEqual(discovery.load_registry(self.path), registry)
+
+    def test_entries_without_serial(self):
+        fd = open(self.path, 'w')
+        json.dump({'darkrai': ['192.168.1.5', 5025]}, fd)
+        fd.close()
+        self.assertEqual(discovery.load_registry(self.path),
+                         {'darkrai': ('192.168.1.5', 5025, None)})
+
+    def test_missing_file(self):
+        self.assertEqual(discovery.load_registry(os.path.join(self.dir, 'none')), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_main
+---------
+
+Tests for `__main__` module.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+from array import array
+from struct import pack
+
+from microlab_instruments import __main__ as cli
+from microlab_instruments import microlab_instruments as mi
+
+
+class FakeDeoxys(mi.Deoxys):
+    """Answers ``:waveform:data?`` with a block of half-precision samples.
+    """
+    def __init__(self, halves):
+        self.DATA = mi.DEOXYS
+        self._socket = None
+        self.block = pack('<{0}H'.format(len(halves)), *halves)
+        self.queries = []
+
+    def write(self, scpi_string):
+        self.queries.append(scpi_string)
+
+    def read_ascii(self, bufsize=4096):
+        return 'LSBF\n'
+
+    def read_binary(self):
+        return self.block + '\n'
+
+
+class TestStream(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.output = os.path.join(self.dir, 'wave')
+        # 1.0, 0.0, -2.0, 65504 (largest half) and 2**-24 (smallest subnormal)
+        self.deoxys = FakeDeoxys([0x3c00, 0x0000, 0xc000, 0x7bff, 0x0001])
+        self.expected = [1.0, 0.0, -2.0, 65504.0, 2.0 ** -24]
+        # The summary goes to stderr
+        self.stderr, sys.stderr = sys.stderr, StringIO()
+
+    def tearDown(self):
+        sys.stderr = self.stderr
+        shutil.rmtree(self.dir)
+
+    def stream(self, *options):
+        args = cli.parser().parse_args(
+            ['stream', 'deoxys', ':waveform:data?', '-o', self.output, '-n', '2'] +
+            list(options))
+        return args.function({'deoxys': self.deoxys}, args)
+
+    def test_binary(self):
+        self.assertEqual(self.stream('--binary'), 0)
+        values = array('d')
+        fd = open(self.output, 'rb')
+        values.fromfile(fd, 2 * len(self.expected))
+        fd.close()
+        self.assertEqual(list(values), 2 * self.expected)
+
+    def test_text(self):
+        self.assertEqual(self.stream(), 0)
+        fd = open(self.output)
+        lines = fd.read().split()
+        fd.close()
+        self.assertEqual([float(v) for v in lines], 2 * self.expected)
+
+    def test_byte_order_is_asked_once_per_block(self):
+        self.stream()
+        self.assertEqual(self.deoxys.queries.count(mi.DEOXYS['get_byte_order']), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
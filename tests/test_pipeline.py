@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_pipeline
+-------------
+
+Tests for `pipeline` module.
+"""
+
+import time
+import unittest
+
+from microlab_instruments.pipeline import AcquisitionPipeline, SharedRingBuffer
+
+
+def _source(blocks):
+    blocks = list(blocks)
+
+    def source():
+        return blocks.pop(0) if blocks else None
+    return source
+
+
+def _run(pipeline, blocks):
+    """Start ``pipeline`` and stop it once ``blocks`` blocks are acquired.
+    """
+    pipeline.start()
+    deadline = time.time() + 10
+    while pipeline.stats()['acquired'] < blocks and time.time() < deadline:
+        time.sleep(0.01)
+    pipeline.stop()
+
+
+def _length(block):
+    return len(block)
+
+
+def _fail_on_odd(block):
+    if len(block) % 2:
+        raise ValueError(block)
+    return len(block)
+
+
+class TestSharedRingBuffer(unittest.TestCase):
+
+    def test_put_get(self):
+        b = SharedRingBuffer(slots=2, slot_size=4)
+        self.assertTrue(b.put('ab', 7))
+        self.assertEqual(b.get(1), (7, 'ab'))
+
+    def test_overrun_is_dropped(self):
+        b = SharedRingBuffer(slots=1, slot_size=4)
+        self.assertTrue(b.put('a'))
+        self.assertFalse(b.put('b'))
+        self.assertFalse(b.put('toolong'))
+        self.assertEqual((b.written, b.dropped, b.oversize), (1, 1, 1))
+
+    def test_close_gives_up_on_full_buffer(self):
+        b = SharedRingBuffer(slots=1, slot_size=4)
+        b.put('a')
+        self.assertEqual(b.close(2, timeout=0.01), 0)
+        self.assertEqual(b.get(1), (0, 'a'))
+        self.assertEqual(b.close(2, timeout=0.01), 1)
+        self.assertEqual(b.get(1), (0, None))
+
+
+class TestAcquisitionPipeline(unittest.TestCase):
+
+    def test_results(self):
+        p = AcquisitionPipeline(_source(['a', 'bb', 'ccc']), _length,
+                                workers=2, slots=4, slot_size=8,
+                                block_until_free=True)
+        _run(p, 3)
+        self.assertEqual(sorted(p.results()), [(0, 1), (1, 2), (2, 3)])
+        self.assertEqual(p.stats()['processed'], 3)
+
+    def test_worker_errors_do_not_stop_the_pipeline(self):
+        p = AcquisitionPipeline(_source(['a', 'bb', 'ccc', 'dddd'] * 10), _fail_on_odd,
+                                workers=2, slots=2, slot_size=8,
+                                block_until_free=True)
+        _run(p, 40)
+        results = dict(p.results())
+        stats = p.stats()
+        self.assertEqual(stats['processed'], 40)
+        self.assertEqual(stats['errors'], 20)
+        self.assertTrue(isinstance(results[0], ValueError))
+        self.assertEqual(results[1], 2)
+
+if __name__ == '__main__':
+    unittest.main()
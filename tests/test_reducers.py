@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_reducers
+-------------
+
+Tests for `reducers` module.
+"""
+
+import math
+import random
+import unittest
+
+from microlab_instruments.reducers import \
+    RunningStats, MinMax, Histogram, Decimator, reduce_stream
+
+
+def _chunks(values, size):
+    return [values[n:n+size] for n in range(0, len(values), size)]
+
+
+class TestReducers(unittest.TestCase):
+
+    def setUp(self):
+        r = random.Random(1)
+        self.values = [r.gauss(5, 2) for n in range(1001)]
+
+    def test_running_stats_merges_chunks(self):
+        stats, = reduce_stream(_chunks(self.values, 97), RunningStats())
+        n = len(self.values)
+        mean = math.fsum(self.values) / n
+        variance = math.fsum([(v - mean) ** 2 for v in self.values]) / (n - 1)
+        self.assertEqual(stats.count, n)
+        self.assertAlmostEqual(stats.mean, mean, places=12)
+        self.assertAlmostEqual(stats.variance, variance, places=10)
+
+    def test_running_stats_single_value(self):
+        stats = RunningStats()
+        stats.update([3.0])
+        stats.update([])
+        self.assertEqual((stats.count, stats.mean, stats.std), (1, 3.0, 0.0))
+
+    def test_min_max(self):
+        m = MinMax()
+        self.assertEqual((m.min, m.max), (None, None))
+        reduce_stream(_chunks(self.values, 100), m)
+        self.assertEqual((m.min, m.max), (min(self.values), max(self.values)))
+
+    def test_histogram(self):
+        h = Histogram(0, 4, bins=4)
+        reduce_stream([[-1, 0, 0.5, 1], [3.999, 4, 2.5]], h)
+        self.assertEqual(list(h.counts), [2, 1, 1, 1])
+        self.assertEqual((h.underflow, h.overflow), (1, 1))
+        self.assertEqual(h.edges, [0, 1, 2, 3, 4])
+
+    def test_decimator_carries_between_chunks(self):
+        d = Decimator(4)
+        reduce_stream([[1, 2, 3], [4, 5, 6, 7, 8, 9], [10]], d)
+        self.assertEqual(list(d.values), [2.5, 6.5])
+        d.update([11, 12])
+        self.assertEqual(list(d.values), [2.5, 6.5, 10.5])
+
+if __name__ == '__main__':
+    unittest.main()